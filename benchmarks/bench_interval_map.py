@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Usage: bench_interval_map.py [options]
+
+Benchmark Interval.mapto and Interval.overlapwith on random intervals. Time
+per interval should stay flat as the input grows.
+
+Options:
+    -h --help         Show help message.
+    --sizes=sizes     Numbers of intervals, comma separated.
+                      [default: 10000,100000,1000000,10000000]
+    --seed=seed       Random seed. [default: 0]
+'''
+
+import time
+import random
+from docopt import docopt
+from seqlib.interval import Interval
+
+__author__ = 'Xiao-Ou Zhang <kepbod@gmail.com>'
+
+
+def make_intervals(n, step, length, tag):
+    '''
+    Create n intervals of given length scattered over n * step bases.
+    '''
+    starts = [random.randrange(n * step) for _ in range(n)]
+    return [[s, s + length, tag] for s in starts]
+
+
+def timeit(func, *args):
+    sta = time.time()
+    func(*args)
+    return time.time() - sta
+
+
+def main():
+    options = docopt(__doc__)
+    random.seed(int(options['--seed']))
+    print('size\tmapto(s)\toverlapwith(s)\tns/interval')
+    for n in [int(x) for x in options['--sizes'].split(',')]:
+        index = make_intervals(n, 300, 200, 'gene')
+        reads = make_intervals(n, 300, 50, 'read')
+        t1 = timeit(Interval.mapto, reads, index)
+        t2 = timeit(Interval.overlapwith, index, reads)
+        print('%d\t%.3f\t%.3f\t%.1f' % (n, t1, t2, (t1 + t2) * 1e9 / n / 2))
+
+
+if __name__ == '__main__':
+    main()
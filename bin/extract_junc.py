@@ -9,20 +9,18 @@ Options:
     --version         Show version.
     -o output_dir     Output file directory [default: ./].
     --url             Extract from remote url.
-    --bb              Convert to BigWig.
+    --bb              Convert to BigBed.
     --uniq            Only fetch unique mapped reads.
     --stranded        Retain strand information.
     --min-reads=min   Minimum junction reads [default: 0].
 '''
 
-import sys
 import os
 import os.path
-import tempfile
-import pysam
 from docopt import docopt
-from seqlib.ngs import fetch_juncfile
-from seqlib.path import which, check_dir
+import pysam
+from seqlib.ngs import fetch_juncfile, bed_to_bigbed
+from seqlib.path import check_dir
 from seqlib.version import __version__
 
 __author__ = 'Xiao-Ou Zhang <kepbod@gmail.com>'
@@ -42,19 +40,10 @@ def main():
                             stranded=options['--stranded'],
                             min=int(options['--min-reads']))
     # create junction bigbed file in case
-    if options['--bb'] and which('bedToBigBed') is not None:
-        prefix = os.path.splitext(os.path.split(options['<bam>'])[-1])[0]
-        bamf = pysam.AlignmentFile(options['<bam>'], 'rb')
-        with tempfile.NamedTemporaryFile() as chrom_size:
-            for seq in bamf.header['SQ']:
-                chrom_size.write('%s\t%s\n' % (seq['SN'], seq['LN']))
-            chrom_size.seek(0)
-            bb_path = os.path.join(dir, prefix + '_junc.bb')
-            return_code = os.system('bedToBigBed -type=bed12 %s %s %s' %
-                                    (junc_f, chrom_size.name, bb_path)) >> 8
-            if return_code:
-                sys.exit('Error: cannot convert bed to BigBed!')
-        bamf.close()
+    if options['--bb']:
+        with pysam.AlignmentFile(options['<bam>'], 'rb') as bamf:
+            chrom_sizes = list(zip(bamf.references, bamf.lengths))
+        bed_to_bigbed(junc_f, chrom_sizes)
 
 
 if __name__ == '__main__':
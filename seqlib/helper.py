@@ -10,7 +10,8 @@ import joblib
 import contextlib
 
 __author__ = 'Xiao-Ou Zhang <kepbod@gmail.com>'
-__all__ = ['check_option', 'run_command', 'download_file', 'check_md5']
+__all__ = ['check_option', 'run_command', 'download_file', 'md5sum',
+           'check_md5']
 
 
 def check_option(n, msg):
@@ -42,11 +43,22 @@ def download_file(local_file, url, chunk_size=1024):
                 f.write(chunk)
 
 
+def md5sum(local_file, chunk_size=1 << 20):
+    '''
+    Compute MD5 of a file chunk by chunk.
+    '''
+    md5 = hashlib.md5()
+    with open(local_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
 def check_md5(local_file, md5):
     '''
     Check MD5.
     '''
-    return hashlib.md5(open(local_file, 'rb').read()).hexdigest() == md5
+    return md5sum(local_file) == md5
 
 
 @contextlib.contextmanager
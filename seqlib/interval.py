@@ -8,6 +8,15 @@ version: 1.0
 
 import sys
 import copy
+from bisect import bisect_right
+from collections import deque, defaultdict
+from itertools import chain
+from operator import itemgetter
+import numpy as np
+from joblib import Parallel, delayed, cpu_count
+
+# inputs of at least this many intervals are merged with NumPy
+VECTORIZED_MERGE_SIZE = 10000
 
 
 class Interval(object):
@@ -45,23 +54,17 @@ class Interval(object):
                overlapwith(index, interval) -> index
     '''
     def __init__(self, interval, instance_flag=0):
-        self.interval = [[int(i[0]), int(i[1])] + i[2:]
-                         for i in Interval.__convert(interval)]
+        interval = Interval.__convert(interval)
+        if not instance_flag and len(interval) >= VECTORIZED_MERGE_SIZE:
+            # large inputs are sorted and merged column-wise with NumPy
+            self.interval = IntervalArray(interval).tolist()
+            return
+        self.interval = [[int(i[0]), int(i[1])] + i[2:] for i in interval]
         if not self.interval:
             return
         if not instance_flag:
             self.interval.sort()
-            tmp = []
-            a = self.interval[0]
-            for b in self.interval[1:]:
-                if a[1] <= b[0]:
-                    tmp.append(a)
-                    a = b
-                else:
-                    a[1] = b[1] if b[1] > a[1] else a[1]
-                    a.extend(b[2:])
-            tmp.append(a)
-            self.interval = tmp
+            self.interval = _merge_sorted(self.interval)
 
     def __len__(self):
         '''
@@ -75,12 +78,11 @@ class Interval(object):
         Usage: c = a + b or a += b
         extract union intervals, 'a' should be instance.
         '''
-        tmp = copy.deepcopy(self.interval)
         if isinstance(interval, Interval):
-            tmp.extend(interval.interval)
+            tmp = self.interval + interval.interval
         else:
-            tmp.extend(Interval.__convert(interval))
-        return Interval(tmp)
+            tmp = self.interval + Interval.__convert(interval)
+        return Interval(tmp)  # items are rebuilt, so no copy is needed
 
     def __radd__(self, interval):
         '''
@@ -139,21 +141,12 @@ class Interval(object):
         if not self.interval:
             return Interval([])
         if isinstance(interval, Interval):
-            tmp = copy.deepcopy(interval)
+            tmp = interval.interval
         else:
-            tmp = Interval(interval)
+            tmp = Interval(interval).interval
         if not tmp:
-            return copy.deepcopy(self)
-        if self.interval[0][0] < tmp.interval[0][0]:
-            sta = self.interval[0][0]
-        else:
-            sta = tmp.interval[0][0]
-        if self.interval[-1][1] > tmp.interval[-1][1]:
-            end = self.interval[-1][1]
-        else:
-            end = tmp.interval[-1][1]
-        tmp.complement(sta, end)
-        return self.__mul__(tmp, real_flag)
+            return Interval([i[:] for i in self.interval], 1)
+        return Interval(_subtract(self.interval, tmp, real_flag), 1)
 
     def __rsub__(self, interval):
         '''
@@ -161,24 +154,14 @@ class Interval(object):
         extract difference intervals, 'a' should be instance.
         '''
         if isinstance(interval, Interval):
-            tmp = copy.deepcopy(interval)
+            tmp = interval.interval
         else:
-            tmp = Interval(interval)
+            tmp = Interval(interval).interval
         if not self.interval:
-            return tmp
+            return Interval([i[:] for i in tmp], 1)
         if not tmp:
             return Interval([])
-        if self.interval[0][0] < tmp.interval[0][0]:
-            sta = self.interval[0][0]
-        else:
-            sta = tmp.interval[0][0]
-        if self.interval[-1][1] > tmp.interval[-1][1]:
-            end = self.interval[-1][1]
-        else:
-            end = tmp.interval[-1][1]
-        tmp_a = copy.deepcopy(self)
-        tmp_a.complement(sta, end)
-        return Interval.__mul__(tmp, tmp_a)
+        return Interval(_subtract(tmp, self.interval), 1)
 
     def __getitem__(self, index):
         '''
@@ -293,6 +276,8 @@ class Interval(object):
 
     @staticmethod
     def __map(index, interval, flag):
+        # fragments are consumed from a queue made of the pending remainders
+        # (clipped to the end of previous index) followed by interval[pos:]
         mapped_fragment = []
         tmp_fragment = []
         if not interval:
@@ -300,24 +285,34 @@ class Interval(object):
                 return mapped_fragment
             else:
                 return index
+        pending = deque()
+        pos = 0
+        total = len(interval)
         for dex in index:
             dex_info = dex[2:]
             while True:
-                try:
-                    fragment = interval.pop(0)
-                except IndexError:
-                    if tmp_fragment:
-                        interval.extend(tmp_fragment)
-                        tmp_fragment = []
-                        continue
+                if pending:
+                    fragment = pending.popleft()
+                    from_pending = True
+                elif pos < total:
+                    fragment = interval[pos]
+                    pos += 1
+                    from_pending = False
+                elif tmp_fragment:
+                    pending.extend(tmp_fragment)
+                    tmp_fragment = []
+                    continue
+                else:
+                    if flag:
+                        return mapped_fragment
                     else:
-                        if flag:
-                            return mapped_fragment
-                        else:
-                            return index
+                        return index
                 if fragment[0] >= dex[1]:
-                    interval.insert(0, fragment)
-                    interval[0:0] = tmp_fragment
+                    if from_pending:
+                        pending.appendleft(fragment)
+                    else:
+                        pos -= 1
+                    pending.extendleft(reversed(tmp_fragment))
                     tmp_fragment = []
                     break
                 elif dex[0] < fragment[1] and dex[1] > fragment[0]:
@@ -334,3 +329,1039 @@ class Interval(object):
                 return mapped_fragment
             else:
                 return index
+
+
+class IntervalArray(object):
+    '''
+    Class: IntervalArray
+
+    Maintainer: Xiao-Ou Zhang
+
+    Version: 1.0
+
+    Usage: a = IntervalArray(list) or IntervalArray(Interval)
+           a = IntervalArray.from_arrays(starts, ends, payload)
+    Notes: columnar counterpart of Interval. Starts and ends are kept in
+           int64 NumPy arrays and the payload ([f1...] of each interval) in
+           a separate list column (None if no interval carries payload).
+           Intervals are merged and sorted in the same way as Interval, and
+           a.tolist() returns exactly what Interval(list).interval holds.
+
+    Attributes: starts, ends, payload
+
+    Functions: c = a + b or a += b
+               c = b + a
+               c = a * b or a *= b
+               c = b * a
+               c = a - b or a -= b
+               c = b - a
+               a[n] or a[n:m]
+               [x, x] in a or [[x, x], [x, x]] not in a
+               a.complement(sta, end)
+               a.extractwith(b)
+               a.extractwithout(b)
+               a.tolist() -> list
+               a.to_interval() -> Interval
+    '''
+    def __init__(self, interval, instance_flag=0):
+        if isinstance(interval, IntervalArray):
+            starts, ends = interval.starts, interval.ends
+            payload = interval.payload
+            instance_flag = 1
+        else:
+            if isinstance(interval, Interval):
+                interval = interval.interval
+                instance_flag = 1
+            starts, ends, payload = _split_columns(interval)
+        if not instance_flag:
+            starts, ends, payload = _merge_columns(starts, ends, payload)
+        self.starts, self.ends, self.payload = starts, ends, payload
+
+    @classmethod
+    def from_arrays(cls, starts, ends, payload=None, instance_flag=0):
+        '''
+        Usage: a = IntervalArray.from_arrays(starts, ends, payload)
+        build intervals from columns without going through nested lists.
+        '''
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        assert starts.shape == ends.shape, 'starts and ends differ in size'
+        if payload is not None:
+            assert len(payload) == len(starts), 'payload differs in size'
+            payload = [list(p) for p in payload]
+        obj = cls.__new__(cls)
+        if not instance_flag:
+            starts, ends, payload = _merge_columns(starts, ends, payload)
+        obj.starts, obj.ends, obj.payload = starts, ends, payload
+        return obj
+
+    def __len__(self):
+        '''
+        Usage: len(c)
+        length of interval c
+        '''
+        return len(self.starts)
+
+    def __add__(self, interval):
+        '''
+        Usage: c = a + b or a += b
+        extract union intervals, 'a' should be instance.
+        '''
+        other = _as_columns(interval, instance_flag=1)
+        starts = np.concatenate((self.starts, other.starts))
+        ends = np.concatenate((self.ends, other.ends))
+        payload = _concat_payload(self, other)
+        return IntervalArray.from_arrays(starts, ends, payload)
+
+    def __radd__(self, interval):
+        '''
+        Usage: c = b + a
+        extract union intervals, 'a' should be instance.
+        '''
+        return self.__add__(interval)
+
+    def __mul__(self, interval, real_flag=1):
+        '''
+        Usage: c = a * b or a *= b
+        extract intersection intervals, 'a' should be instance.
+        '''
+        other = _as_columns(interval)
+        return _intersect_columns(self, other, real_flag)
+
+    def __rmul__(self, interval):
+        '''
+        Usage: c = b * a
+        extract intersection intervals, 'a' should be instance.
+        '''
+        return self.__mul__(interval)
+
+    def __sub__(self, interval, real_flag=1):
+        '''
+        Usage: c = a - b or a -= b
+        extract difference intervals, 'a' should be instance.
+        '''
+        if not len(self):
+            return IntervalArray([])
+        other = _as_columns(interval)
+        if not len(other):
+            return IntervalArray(self)
+        sta = min(self.starts[0], other.starts[0])
+        end = max(self.ends[-1], other.ends[-1])
+        other = IntervalArray(other)
+        other.complement(sta, end)
+        return self.__mul__(other, real_flag)
+
+    def __rsub__(self, interval):
+        '''
+        Usage: c = b - a
+        extract difference intervals, 'a' should be instance.
+        '''
+        other = _as_columns(interval)
+        return IntervalArray.__sub__(IntervalArray(other), self)
+
+    def __getitem__(self, index):
+        '''
+        Usage: a[n] or a[n:m]
+        intercept index and slice on interval objects.
+        '''
+        if isinstance(index, slice):
+            return [self.__item(i) for i in range(len(self))[index]]
+        return self.__item(range(len(self))[index])
+
+    def __repr__(self):
+        '''
+        print objects.
+        '''
+        return repr(self.tolist())
+
+    def __contains__(self, interval):
+        '''
+        Usage: [x, x] in a or [[x, x], [x, x]] not in a
+        judge whether interval is in a or not, 'a' should be instance.
+        '''
+        return len(self.__mul__(interval)) > 0
+
+    def complement(self, sta='#', end='#'):
+        '''
+        Usage: a.complement(sta, end)
+        complement of 'a'.
+        '''
+        gap_sta, gap_end = self.ends[:-1], self.starts[1:]
+        mask = gap_sta != gap_end
+        starts, ends = [gap_sta[mask]], [gap_end[mask]]
+        if sta != '#' and sta < self.starts[0]:
+            starts.insert(0, [sta])
+            ends.insert(0, [self.starts[0]])
+        if end != '#' and end > self.ends[-1]:
+            starts.append([self.ends[-1]])
+            ends.append([end])
+        self.starts = np.concatenate(starts).astype(np.int64)
+        self.ends = np.concatenate(ends).astype(np.int64)
+        self.payload = None
+
+    def extractwith(self, interval):
+        '''
+        Usage: a.extractwith(b)
+        extract intervals in 'b'.
+        '''
+        tmp = self.__mul__(interval, 0)
+        self.starts, self.ends = tmp.starts, tmp.ends
+        self.payload = tmp.payload
+
+    def extractwithout(self, interval):
+        '''
+        Usage: a.extractwithout(b)
+        extract intervals not in 'b'.
+        '''
+        tmp = self.__sub__(interval, 0)
+        self.starts, self.ends = tmp.starts, tmp.ends
+        self.payload = tmp.payload
+
+    def tolist(self):
+        '''
+        Usage: a.tolist()
+        convert to the nested list form used by Interval.
+        '''
+        coords = zip(self.starts.tolist(), self.ends.tolist())
+        if self.payload is None:
+            return [[s, e] for s, e in coords]
+        return [[s, e] + p for (s, e), p in zip(coords, self.payload)]
+
+    def to_interval(self):
+        '''
+        Usage: a.to_interval()
+        convert to Interval without merging again.
+        '''
+        return Interval(self.tolist(), 1)
+
+    def __item(self, i):
+        item = [int(self.starts[i]), int(self.ends[i])]
+        if self.payload is not None:
+            item.extend(self.payload[i])
+        return item
+
+
+class IntervalIndex(object):
+    '''
+    Class: IntervalIndex
+
+    Maintainer: Xiao-Ou Zhang
+
+    Version: 1.0
+
+    Usage: idx = IntervalIndex(list)
+           (nested list: [[x,x,f1...],[x,x,f2...]...] / [[x,x],[x,x]...] or
+            simple list: [x,x,f1...] / [x,x])
+    Notes: unlike Interval, intervals are kept as they are (not merged), and
+           they are organized into a nested containment list (NCList) once,
+           so that overlap queries take O(log n + k) time. Build one index
+           per chromosome (and strand) and query it many times.
+
+    For example: idx = IntervalIndex([[1, 10, 'a'], [3, 5, 'b'],
+                                      [8, 20, 'c']])
+                 idx.find(4, 9) -> [[1, 10, 'a'], [3, 5, 'b'], [8, 20, 'c']]
+                 idx.find_point(12) -> [[8, 20, 'c']]
+
+    Attributes: interval (sorted by start)
+
+    Functions: len(idx)
+               idx.find(sta, end) -> interval
+               idx.find_point(pos) -> interval
+               idx.find_batch(interval) -> [interval, ...]
+               idx.count_batch(interval) -> counts
+               idx.upstream(sta, end, strand) -> (index, distance)
+               idx.downstream(sta, end, strand) -> (index, distance)
+               idx.nearest(sta, end, strand) -> (index, distance)
+               idx.window(sta, end, distance) -> [interval, ...]
+    '''
+    def __init__(self, interval):
+        if isinstance(interval, (Interval, IntervalArray)):
+            interval = interval[:]
+        elif interval and type(interval) is list and \
+                type(interval[0]) is not list:
+            interval = [interval]
+        items = [[int(i[0]), int(i[1])] + i[2:] for i in interval]
+        n = len(items)
+        starts = np.fromiter((i[0] for i in items), np.int64, n)
+        ends = np.fromiter((i[1] for i in items), np.int64, n)
+        order = np.lexsort((-ends, starts)).tolist()
+        sorted_ends = ends[order].tolist()
+        # find the innermost interval containing each interval
+        children = [[] for _ in range(n + 1)]  # the last one is the root
+        stack = []
+        for k in range(n):
+            while stack and sorted_ends[stack[-1]] < sorted_ends[k]:
+                stack.pop()
+            children[stack[-1] if stack else n].append(k)
+            stack.append(k)
+        # lay out every sublist contiguously, breadth first
+        layout = list(children[n])
+        self._sub = [None] * n
+        pos = 0
+        root_hi = len(layout)
+        while pos < len(layout):
+            k = layout[pos]
+            if children[k]:
+                self._sub[pos] = (len(layout), len(layout) + len(children[k]))
+                layout.extend(children[k])
+            pos += 1
+        self._root = (0, root_hi)
+        self._rank = layout
+        self._starts = [int(starts[order[k]]) for k in layout]
+        self._ends = [sorted_ends[k] for k in layout]
+        self.interval = [items[k] for k in order]
+        # columns for nearest queries, in the order of self.interval
+        self._start_col = starts[order]
+        end_col = ends[order]
+        self._end_order = np.argsort(end_col, kind='stable')
+        self._end_col = end_col[self._end_order]
+        self._run_end = np.maximum.accumulate(end_col) if n else end_col
+        self._run_arg = np.maximum.accumulate(
+            np.where(end_col == self._run_end, np.arange(n), 0))
+
+    def __len__(self):
+        '''
+        Usage: len(idx)
+        number of indexed intervals.
+        '''
+        return len(self.interval)
+
+    def find(self, sta, end):
+        '''
+        Usage: idx.find(sta, end)
+        fetch intervals overlapping [sta, end), ordered by start.
+        '''
+        return [self.interval[k] for k in self.__query(int(sta), int(end))]
+
+    def find_point(self, pos):
+        '''
+        Usage: idx.find_point(pos)
+        fetch intervals covering position pos.
+        '''
+        return self.find(pos, int(pos) + 1)
+
+    def find_batch(self, interval):
+        '''
+        Usage: idx.find_batch([[x, x], [x, x]...])
+        fetch intervals overlapping each query interval.
+        '''
+        return [self.find(i[0], i[1]) for i in interval]
+
+    def count_batch(self, interval):
+        '''
+        Usage: idx.count_batch([[x, x], [x, x]...])
+        count intervals overlapping each query interval.
+        '''
+        return np.fromiter((len(self.__query(int(i[0]), int(i[1])))
+                            for i in interval), np.int64, len(interval))
+
+    def upstream(self, sta, end=None, strand='+'):
+        '''
+        Usage: idx.upstream(sta, end, strand) -> (index, distance)
+        nearest upstream intervals of each query [sta, end) (end defaults to
+        sta + 1), i.e. ending before sta on '+' strand or starting after end
+        on '-' strand. Return arrays of positions in idx.interval and gaps
+        in bases, or -1 for both if there is none.
+        '''
+        sta, end, minus = _query_columns(sta, end, strand)
+        left, right = self.__left(sta), self.__right(end)
+        return (np.where(minus, right[0], left[0]),
+                np.where(minus, right[1], left[1]))
+
+    def downstream(self, sta, end=None, strand='+'):
+        '''
+        Usage: idx.downstream(sta, end, strand) -> (index, distance)
+        nearest downstream intervals of each query, see idx.upstream.
+        '''
+        sta, end, minus = _query_columns(sta, end, strand)
+        left, right = self.__left(sta), self.__right(end)
+        return (np.where(minus, left[0], right[0]),
+                np.where(minus, left[1], right[1]))
+
+    def nearest(self, sta, end=None, strand='+'):
+        '''
+        Usage: idx.nearest(sta, end, strand) -> (index, distance)
+        nearest intervals of each query. Distance is 0 for overlapping
+        intervals, negative for upstream and positive for downstream ones;
+        ties go upstream. Index is -1 if the index is empty.
+        '''
+        sta, end, minus = _query_columns(sta, end, strand)
+        up_index, up_dis = self.upstream(sta, end, np.where(minus, '-', '+'))
+        down_index, down_dis = self.downstream(sta, end,
+                                               np.where(minus, '-', '+'))
+        use_up = (up_index >= 0) & ((down_index < 0) | (up_dis <= down_dis))
+        index = np.where(use_up, up_index, down_index)
+        dis = np.where(use_up, -up_dis, down_dis)
+        dis[index < 0] = -1
+        # overlapping intervals: the one reaching farthest among those
+        # starting before end
+        k = np.searchsorted(self._start_col, end, side='left') - 1
+        k_safe = np.maximum(k, 0)
+        overlap = (k >= 0) & (self._run_end[k_safe] > sta) if len(self) \
+            else np.zeros(len(sta), dtype=bool)
+        if overlap.any():
+            index = np.where(overlap, self._run_arg[k_safe], index)
+            dis = np.where(overlap, 0, dis)
+        return index, dis
+
+    def window(self, sta, end=None, distance=0):
+        '''
+        Usage: idx.window(sta, end, distance) -> [interval, ...]
+        fetch intervals overlapping or within distance bases of each query
+        [sta, end), with distance counted as in idx.upstream.
+        '''
+        sta = np.atleast_1d(np.asarray(sta, dtype=np.int64))
+        end = sta + 1 if end is None else np.atleast_1d(
+            np.asarray(end, dtype=np.int64))
+        return [self.find(s - distance - 1, e + distance + 1)
+                for s, e in zip(sta.tolist(), end.tolist())]
+
+    def __left(self, sta):
+        # intervals ending no later than sta
+        k = np.searchsorted(self._end_col, sta, side='right') - 1
+        found = k >= 0
+        k_safe = np.maximum(k, 0)
+        if not len(self):
+            return np.full(len(sta), -1), np.full(len(sta), -1)
+        index = np.where(found, self._end_order[k_safe], -1)
+        dis = np.where(found, sta - self._end_col[k_safe], -1)
+        return index, dis
+
+    def __right(self, end):
+        # intervals starting no earlier than end
+        k = np.searchsorted(self._start_col, end, side='left')
+        found = k < len(self)
+        k_safe = np.minimum(k, max(len(self) - 1, 0))
+        if not len(self):
+            return np.full(len(end), -1), np.full(len(end), -1)
+        index = np.where(found, k_safe, -1)
+        dis = np.where(found, self._start_col[k_safe] - end, -1)
+        return index, dis
+
+    def __query(self, sta, end):
+        hits = []
+        blocks = [self._root]
+        starts, ends, sub = self._starts, self._ends, self._sub
+        while blocks:
+            lo, hi = blocks.pop()
+            # ends are increasing within a sublist
+            p = bisect_right(ends, sta, lo, hi)
+            while p < hi and starts[p] < end:
+                hits.append(p)
+                if sub[p] is not None:
+                    blocks.append(sub[p])
+                p += 1
+        rank = self._rank
+        return sorted(rank[p] for p in hits)
+
+
+class GenomicIntervalSet(object):
+    '''
+    Class: GenomicIntervalSet
+
+    Maintainer: Xiao-Ou Zhang
+
+    Version: 1.0
+
+    Usage: a = GenomicIntervalSet(list, stranded=False, chrom_order=None)
+           (list: [[chrom,x,x,f1...],...] or, if stranded,
+            [[chrom,x,x,strand,f1...],...])
+    Notes: intervals are partitioned by chromosome (and strand if stranded),
+           and every partition is an Interval. Partitions are iterated in
+           genome order, which is chrom_order (e.g. BAM header order) if
+           given, otherwise sorted chromosome names as in `sort -k1,1`.
+
+    Attributes: stranded
+
+    Functions: a.add(chrom, interval, strand)
+               c = a + b, c = a * b, c = a - b
+               a.union(b, n_jobs), a.intersection(b, n_jobs),
+               a.difference(b, n_jobs)
+               a[chrom] or a[chrom, strand] -> Interval
+               a.keys() -> [(chrom, strand)...]
+               for chrom, strand, itl in a.items(merge)
+    '''
+    def __init__(self, interval=None, stranded=False, chrom_order=None):
+        self.stranded = stranded
+        self._chrom_order = chrom_order
+        self._partition = defaultdict(list)
+        self._merged = {}
+        for i in interval or []:
+            if stranded:
+                self.add(i[0], [i[1], i[2]] + i[4:], strand=i[3])
+            else:
+                self.add(i[0], [i[1], i[2]] + i[3:])
+
+    def add(self, chrom, interval, strand=None):
+        '''
+        Usage: a.add(chrom, [x, x, f1...]) or a.add(chrom, [[x, x]...], '+')
+        add intervals onto chrom (and strand).
+        '''
+        if not interval:
+            return
+        key = (chrom, strand if self.stranded else None)
+        if type(interval[0]) is list:
+            self._partition[key].extend(interval)
+        else:
+            self._partition[key].append(interval)
+        self._merged.pop(key, None)
+
+    def keys(self):
+        '''
+        Usage: a.keys()
+        (chrom, strand) of every partition in genome order.
+        '''
+        if self._chrom_order is None:
+            rank = {}
+        else:
+            rank = {c: n for n, c in enumerate(self._chrom_order)}
+        return sorted(self._partition, key=lambda k: (rank.get(k[0],
+                                                               len(rank)),
+                                                      k[0], k[1] or ''))
+
+    def __getitem__(self, key):
+        '''
+        Usage: a[chrom] or a[chrom, strand]
+        merged intervals of one partition.
+        '''
+        if not isinstance(key, tuple):
+            key = (key, None)
+        if key not in self._merged:
+            self._merged[key] = Interval(self._partition.get(key, []))
+        return self._merged[key]
+
+    def __len__(self):
+        '''
+        Usage: len(a)
+        number of merged intervals in all partitions.
+        '''
+        return sum(len(self[key]) for key in self._partition)
+
+    def __iter__(self):
+        return self.items()
+
+    def items(self, merge=True):
+        '''
+        Usage: for chrom, strand, itl in a.items(merge)
+        stream intervals in genome order, merged or as they were added.
+        '''
+        for key in self.keys():
+            if merge:
+                partition = self[key].interval
+            else:
+                partition = self._partition[key]
+            for itl in partition:
+                yield key[0], key[1], itl
+
+    def union(self, interval, n_jobs=1):
+        '''
+        Usage: a.union(b, n_jobs)
+        union of each partition, 'b' should be GenomicIntervalSet.
+        '''
+        keys = set(self._partition) | set(interval._partition)
+        return self.__apply('union', interval, keys, n_jobs)
+
+    def intersection(self, interval, n_jobs=1):
+        '''
+        Usage: a.intersection(b, n_jobs)
+        intersection of each partition, 'b' should be GenomicIntervalSet.
+        '''
+        keys = set(self._partition) & set(interval._partition)
+        return self.__apply('intersection', interval, keys, n_jobs)
+
+    def difference(self, interval, n_jobs=1):
+        '''
+        Usage: a.difference(b, n_jobs)
+        difference of each partition, 'b' should be GenomicIntervalSet.
+        '''
+        return self.__apply('difference', interval, set(self._partition),
+                            n_jobs)
+
+    def __add__(self, interval):
+        '''
+        Usage: c = a + b or a += b
+        '''
+        return self.union(interval)
+
+    def __mul__(self, interval):
+        '''
+        Usage: c = a * b or a *= b
+        '''
+        return self.intersection(interval)
+
+    def __sub__(self, interval):
+        '''
+        Usage: c = a - b or a -= b
+        '''
+        return self.difference(interval)
+
+    def __apply(self, op, interval, keys, n_jobs):
+        assert self.stranded == interval.stranded, \
+            'cannot combine stranded and unstranded sets'
+        keys = sorted(keys, key=lambda k: (k[0], k[1] or ''))
+        jobs = [(op, self._partition.get(key, []),
+                 interval._partition.get(key, [])) for key in keys]
+        if n_jobs == 1:
+            results = [_partition_op(*job) for job in jobs]
+        else:
+            results = Parallel(n_jobs=n_jobs)(delayed(_partition_op)(*job)
+                                              for job in jobs)
+        tmp = GenomicIntervalSet(stranded=self.stranded,
+                                 chrom_order=self._chrom_order)
+        for key, result in zip(keys, results):
+            if result:
+                tmp._partition[key] = result
+                tmp._merged[key] = Interval(result, 1)
+        return tmp
+
+
+def _query_columns(sta, end, strand):
+    '''
+    Convert queries of nearest searches into arrays.
+    '''
+    sta = np.atleast_1d(np.asarray(sta, dtype=np.int64))
+    if end is None:
+        end = sta + 1
+    else:
+        end = np.atleast_1d(np.asarray(end, dtype=np.int64))
+    minus = np.broadcast_to(np.asarray(strand) == '-', sta.shape)
+    return sta, end, minus
+
+
+def _gaps(interval, sta, end):
+    '''
+    Yield the complement of merged intervals within [sta, end] lazily, in the
+    same way as Interval.complement(sta, end).
+    '''
+    if sta < interval[0][0]:
+        yield [sta, interval[0][0]]
+    a = interval[0][1]
+    for item in interval[1:]:
+        if a != item[0]:
+            yield [a, item[0]]
+        a = item[1]
+    if end > a:
+        yield [a, end]
+
+
+def _subtract(interval1, interval2, real_flag=1):
+    '''
+    Subtract merged intervals2 from merged interval1 in one sweep.
+    '''
+    sta = min(interval1[0][0], interval2[0][0])
+    end = max(interval1[-1][1], interval2[-1][1])
+    gaps = _gaps(interval2, sta, end)
+    b = next(gaps, None)
+    if b is None:
+        return []
+    tmp = []
+    i = 1
+    a = interval1[0]
+    while True:
+        sta = a[0] if a[0] > b[0] else b[0]
+        end = a[1] if a[1] < b[1] else b[1]
+        if sta < end:
+            if real_flag:
+                tmp.append([sta, end] + a[2:])
+            else:
+                tmp.append(copy.copy(a))
+        if a[1] == end:
+            if i == len(interval1):
+                break
+            a = interval1[i]
+            i += 1
+        if b[1] == end:
+            b = next(gaps, None)
+            if b is None:
+                break
+    return tmp
+
+
+def _partition_op(op, interval1, interval2):
+    '''
+    Run one set operation on a partition of GenomicIntervalSet.
+    '''
+    if op == 'union':
+        return Interval(interval1 + interval2).interval
+    elif op == 'intersection':
+        return (Interval(interval1) * Interval(interval2)).interval
+    else:
+        return (Interval(interval1) - Interval(interval2)).interval
+
+
+def _merge_sorted(interval):
+    '''
+    Merge sorted [start, end, *payload] lists in place.
+    '''
+    tmp = []
+    a = interval[0]
+    for b in interval[1:]:
+        if a[1] <= b[0]:
+            tmp.append(a)
+            a = b
+        else:
+            a[1] = b[1] if b[1] > a[1] else a[1]
+            a.extend(b[2:])
+    tmp.append(a)
+    return tmp
+
+
+def merge_sorted(interval):
+    '''
+    merge_sorted(interval) -> generator
+    Merge intervals sorted by start, e.g. lines of a coordinate-sorted BED
+    file of one chromosome, and yield merged [x, x, f1...] in order.
+    Payloads of merged intervals are concatenated in input order. Only the
+    current interval is kept in memory.
+    >>> list(merge_sorted([[1, 10, 'a'], [7, 12, 'c'], [17, 22, 'b'],
+    ...                    [20, 25, 'd'], [30, 35, 'e']]))
+    [[1, 12, 'a', 'c'], [17, 25, 'b', 'd'], [30, 35, 'e']]
+    '''
+    a = None
+    for i in interval:
+        b = [int(i[0]), int(i[1])] + list(i[2:])
+        if a is None:
+            a = b
+            continue
+        assert b[0] >= a[0], 'intervals are not sorted: {} after {}'.format(
+            b[:2], a[:2])
+        if a[1] <= b[0]:
+            yield a
+            a = b
+        else:
+            a[1] = b[1] if b[1] > a[1] else a[1]
+            a.extend(b[2:])
+    if a is not None:
+        yield a
+
+
+def intersect_sorted(interval1, interval2):
+    '''
+    intersect_sorted(interval1, interval2) -> generator
+    Intersect two interval streams sorted by start, as Interval.__mul__.
+    >>> list(intersect_sorted([[1, 12, 'a'], [17, 25, 'b']],
+    ...                       [[5, 12, 'I'], [20, 22, 'II'], [23, 28, 'III']]))
+    [[5, 12, 'a', 'I'], [20, 22, 'b', 'II'], [23, 25, 'b', 'III']]
+    '''
+    return _intersect_streams(merge_sorted(interval1),
+                              merge_sorted(interval2))
+
+
+def subtract_sorted(interval1, interval2):
+    '''
+    subtract_sorted(interval1, interval2) -> generator
+    Subtract sorted interval2 from sorted interval1, as Interval.__sub__.
+    >>> list(subtract_sorted([[1, 12, 'a'], [17, 25, 'b']],
+    ...                      [[5, 12, 'I'], [20, 22, 'II'], [23, 28, 'III']]))
+    [[1, 5, 'a'], [17, 20, 'b'], [22, 23, 'b']]
+    '''
+    interval2 = merge_sorted(interval2)
+    b = next(interval2, None)
+    if b is None:  # nothing to subtract
+        for a in merge_sorted(interval1):
+            yield a
+        return
+    gaps = _stream_gaps(chain([b], interval2))
+    for a in _intersect_streams(merge_sorted(interval1), gaps):
+        yield a
+
+
+def intersect_many(reference, queries, n_jobs=1, count=False):
+    '''
+    intersect_many(reference, queries, n_jobs, count) -> [interval...]
+    Intersect every query interval list with one reference, giving the same
+    result as (Interval(query) * reference).interval for each query. The
+    reference is sorted and merged only once, and queries can be split over
+    n_jobs processes. If count is True, return the number of intersected
+    intervals of each query as an array instead.
+    >>> intersect_many([[5, 12, 'I'], [20, 28, 'II']],
+    ...                [[[1, 10, 'a']], [[11, 21, 'b'], [30, 35, 'c']]])
+    [[[5, 10, 'a', 'I']], [[11, 12, 'b', 'I'], [20, 21, 'b', 'II']]]
+    >>> intersect_many([[5, 12], [20, 28]], [[[1, 10]], [[11, 21]], []],
+    ...                count=True).tolist()
+    [1, 2, 0]
+    '''
+    ref = IntervalArray(reference)
+    if n_jobs is None:  # as joblib does
+        n_jobs = 1
+    if n_jobs == 1 or len(queries) < 2:
+        results = _intersect_chunk(ref, queries, count)
+    else:
+        # one chunk per worker, so that the reference is shipped only once
+        if n_jobs < 0:
+            n_jobs = max(cpu_count() + 1 + n_jobs, 1)
+        n_chunks = min(len(queries), n_jobs)
+        size = -(-len(queries) // n_chunks)
+        chunks = [queries[i:i + size] for i in range(0, len(queries), size)]
+        results = Parallel(n_jobs=n_jobs)(delayed(_intersect_chunk)(ref,
+                                                                    chunk,
+                                                                    count)
+                                          for chunk in chunks)
+        results = list(chain.from_iterable(results))
+    if count:
+        return np.array(results, dtype=np.int64)
+    return results
+
+
+def _intersect_chunk(reference, queries, count):
+    '''
+    Intersect a chunk of queries with a prepared reference.
+    '''
+    results = []
+    for query in queries:
+        tmp = _intersect_columns(IntervalArray(query), reference)
+        results.append(len(tmp) if count else tmp.tolist())
+    return results
+
+
+def coverage(interval, zero=False, sta=None, end=None):
+    '''
+    coverage(interval, zero, sta, end) -> [[x, x, depth]...]
+    Compute how many intervals cover each position, as run-length encoded
+    bedgraph-style segments. Overlapping intervals are counted separately,
+    and adjacent segments of the same depth are joined. Zero-depth segments
+    are reported only if zero is True. Segments are clipped to [sta, end)
+    (default: first start to last end), and with zero, the whole window is
+    covered, even if there is no interval at all.
+    >>> coverage([[1, 10], [5, 12], [5, 8], [20, 25]])
+    [[1, 5, 1], [5, 8, 3], [8, 10, 2], [10, 12, 1], [20, 25, 1]]
+    >>> coverage([[3, 5], [5, 8]], zero=True, sta=0, end=10)
+    [[0, 3, 0], [3, 8, 1], [8, 10, 0]]
+    >>> coverage([[3, 5], [5, 8]], zero=True, sta=4, end=6)
+    [[4, 6, 1]]
+    >>> coverage([], zero=True, sta=0, end=10)
+    [[0, 10, 0]]
+    '''
+    if isinstance(interval, (Interval, IntervalArray)):
+        interval = interval[:]
+    elif interval and type(interval[0]) is not list:
+        interval = [interval]
+    if len(interval) >= VECTORIZED_MERGE_SIZE:
+        starts, ends, _ = _split_columns(interval)
+        assert (starts <= ends).all(), 'intervals should not be reversed'
+        pos, depth = _coverage_columns(starts, ends)
+    else:
+        events = defaultdict(int)
+        for i in interval:
+            assert int(i[0]) <= int(i[1]), \
+                'interval {} is reversed'.format(i)
+            events[int(i[0])] += 1
+            events[int(i[1])] -= 1
+        pos = sorted(events)
+        depth = []
+        n = 0
+        for p in pos[:-1]:
+            n += events[p]
+            depth.append(n)
+    tmp = []
+    for a, b, n in zip(pos[:-1], pos[1:], depth):
+        if not n and not zero:
+            continue
+        if tmp and tmp[-1][2] == n and tmp[-1][1] == a:
+            tmp[-1][1] = b
+        else:
+            tmp.append([a, b, n])
+    # clip to [sta, end), then pad the window with zero-depth segments
+    sta = int(sta) if sta is not None else (pos[0] if pos else None)
+    end = int(end) if end is not None else (pos[-1] if pos else None)
+    if sta is None or end is None:
+        return tmp
+    tmp = [[max(a, sta), min(b, end), n] for a, b, n in tmp
+           if b > sta and a < end]
+    if zero and sta < end:
+        if not tmp:
+            return [[sta, end, 0]]
+        if tmp[0][0] > sta:
+            tmp.insert(0, [sta, tmp[0][0], 0])
+        if tmp[-1][1] < end:
+            tmp.append([tmp[-1][1], end, 0])
+    return tmp
+
+
+def _coverage_columns(starts, ends):
+    '''
+    Return breakpoints and depth between consecutive breakpoints.
+    '''
+    if not len(starts):
+        return [], []
+    pos = np.concatenate((starts, ends))
+    delta = np.concatenate((np.ones(len(starts), dtype=np.int64),
+                            -np.ones(len(ends), dtype=np.int64)))
+    pos, depth = _sweep_depth(pos, delta)
+    return pos.tolist(), depth.tolist()
+
+
+def _sweep_depth(pos, delta):
+    '''
+    Return sorted breakpoints and depth between consecutive breakpoints, from
+    NumPy arrays of event positions and their depth changes.
+    '''
+    if not len(pos):
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    order = np.argsort(pos, kind='stable')
+    pos, delta = pos[order], delta[order]
+    first = np.flatnonzero(np.concatenate(([True], pos[1:] != pos[:-1])))
+    depth = np.cumsum(np.add.reduceat(delta, first))
+    return pos[first], depth[:-1]
+
+
+def _stream_gaps(interval):
+    '''
+    Yield the complement of merged intervals, open at both ends.
+    '''
+    a = -float('inf')
+    for item in interval:
+        if a != item[0]:
+            yield [a, item[0]]
+        a = item[1]
+    yield [a, float('inf')]
+
+
+def _intersect_streams(interval1, interval2):
+    '''
+    Intersect two merged interval iterators.
+    '''
+    a = next(interval1, None)
+    b = next(interval2, None)
+    while a is not None and b is not None:
+        sta = a[0] if a[0] > b[0] else b[0]
+        end = a[1] if a[1] < b[1] else b[1]
+        if sta < end:
+            yield [sta, end] + a[2:] + b[2:]
+        if a[1] == end:
+            a = next(interval1, None)
+        if b[1] == end:
+            b = next(interval2, None)
+
+
+def _as_columns(interval, instance_flag=0):
+    if isinstance(interval, IntervalArray):
+        return interval
+    return IntervalArray(interval, instance_flag)
+
+
+def _split_columns(interval):
+    '''
+    Split (nested) list into start, end and payload columns.
+    '''
+    assert type(interval) is list, 'the type is {}'.format(type(interval))
+    if interval and type(interval[0]) is not list:
+        interval = [interval]
+    n = len(interval)
+    starts = np.fromiter(map(int, map(itemgetter(0), interval)), np.int64, n)
+    ends = np.fromiter(map(int, map(itemgetter(1), interval)), np.int64, n)
+    if any(len(i) > 2 for i in interval):
+        payload = [i[2:] for i in interval]
+    else:
+        payload = None
+    return starts, ends, payload
+
+
+def _concat_payload(a, b):
+    if a.payload is None and b.payload is None:
+        return None
+    payload_a = a.payload if a.payload is not None else [[]] * len(a)
+    payload_b = b.payload if b.payload is not None else [[]] * len(b)
+    return payload_a + payload_b
+
+
+def _sort_columns(starts, ends, payload):
+    '''
+    Return the order in which list.sort() would place [start, end, *payload]
+    items.
+    '''
+    order = np.lexsort((ends, starts))
+    if payload is None or len(order) < 2:
+        return order
+    s, e = starts[order], ends[order]
+    tie = (s[1:] == s[:-1]) & (e[1:] == e[:-1])
+    if not tie.any():
+        return order
+    # break (start, end) ties by payload as list comparison does
+    order = order.tolist()
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], tie, [0]))))
+    for sta, end in zip(edges[::2], edges[1::2] + 1):
+        order[sta:end] = sorted(order[sta:end], key=lambda k: payload[k])
+    return np.array(order, dtype=np.int64)
+
+
+def _merge_columns(starts, ends, payload):
+    '''
+    Sort and merge overlapping intervals, concatenating payloads of merged
+    intervals in sorted order.
+    '''
+    if not len(starts):
+        return starts, ends, payload
+    order = _sort_columns(starts, ends, payload)
+    starts, ends = starts[order], ends[order]
+    if payload is not None:
+        payload = _take(payload, order)
+    if (ends < starts).any():  # reversed intervals break the running max
+        coords = zip(starts.tolist(), ends.tolist())
+        if payload is None:
+            merged = [[s, e] for s, e in coords]
+        else:
+            merged = [[s, e] + p for (s, e), p in zip(coords, payload)]
+        return _split_columns(_merge_sorted(merged))
+    run_end = np.maximum.accumulate(ends)
+    new_group = np.empty(len(starts), dtype=bool)
+    new_group[0] = True
+    new_group[1:] = starts[1:] >= run_end[:-1]
+    idx = np.flatnonzero(new_group)
+    merged_starts = starts[idx]
+    merged_ends = np.maximum.reduceat(ends, idx)
+    if payload is not None:
+        bounds = np.append(idx, len(starts))
+        multi = np.flatnonzero(np.diff(bounds) > 1)
+        merged_payload = _take(payload, idx)
+        for k, sta, end in zip(multi.tolist(), bounds[multi].tolist(),
+                               bounds[multi + 1].tolist()):
+            merged_payload[k] = list(chain.from_iterable(payload[sta:end]))
+        payload = merged_payload
+    return merged_starts, merged_ends, payload
+
+
+def _take(lst, idx):
+    '''
+    Return [lst[k] for k in idx] without a Python-level loop.
+    '''
+    if len(idx) == 0:
+        return []
+    if len(idx) == 1:
+        return [lst[int(idx[0])]]
+    return list(itemgetter(*idx.tolist())(lst))
+
+
+def _intersect_columns(a, b, real_flag=1):
+    '''
+    Intersect two merged interval columns.
+    '''
+    if not len(a) or not len(b):
+        return IntervalArray([])
+    # b[j] overlaps a[i] if b.ends[j] > a.starts[i] and b.starts[j] < a.ends[i]
+    lo = np.searchsorted(b.ends, a.starts, side='right')
+    hi = np.searchsorted(b.starts, a.ends, side='left')
+    counts = np.maximum(hi - lo, 0)
+    ai = np.repeat(np.arange(len(a)), counts)
+    offsets = np.arange(len(ai)) - np.repeat(np.cumsum(counts) - counts,
+                                             counts)
+    bi = np.repeat(lo, counts) + offsets
+    sta = np.maximum(a.starts[ai], b.starts[bi])
+    end = np.minimum(a.ends[ai], b.ends[bi])
+    keep = sta < end
+    ai, bi, sta, end = ai[keep], bi[keep], sta[keep], end[keep]
+    if real_flag:
+        if a.payload is None and b.payload is None:
+            payload = None
+        else:
+            pa = a.payload if a.payload is not None else [[]] * len(a)
+            pb = b.payload if b.payload is not None else [[]] * len(b)
+            payload = [pa[i] + pb[j] for i, j in zip(ai.tolist(),
+                                                     bi.tolist())]
+        return IntervalArray.from_arrays(sta, end, payload, instance_flag=1)
+    else:
+        payload = None
+        if a.payload is not None:
+            payload = [a.payload[i] for i in ai.tolist()]
+        return IntervalArray.from_arrays(a.starts[ai], a.ends[ai], payload,
+                                         instance_flag=1)
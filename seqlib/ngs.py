@@ -5,15 +5,25 @@ NGS relevant functions and classes
 import sys
 import os
 import os.path
-import re
+import struct
+import zlib
+import contextlib
 from collections import defaultdict
 import tempfile
+import numpy as np
 import pysam
 import pybedtools
+from joblib import Parallel, delayed
+from .interval import _sweep_depth
 
 __author__ = 'Xiao-Ou Zhang <kepbod@gmail.com>'
 __all__ = ['check_fasta', 'check_bam', 'check_bed', 'fetch_juncfile',
-           'bam_to_bedgraph']
+           'bed_to_bigbed', 'bam_to_bedgraph', 'write_bigwig',
+           'write_bigbed']
+
+CIGAR_ALIGNED = (0, 7, 8)  # M, =, X
+CIGAR_GAP = (2, 3)  # D, N
+COVERAGE_CHUNK = 1 << 16  # blocks buffered per track before aggregation
 
 
 def check_fasta(fa, return_handle=True):
@@ -70,11 +80,14 @@ def check_bed(bed, return_handle=True):
 
 
 def fetch_juncfile(bam, url=False, dir=None, uniq=False, stranded=False,
-                   min=0):
+                   min=0, n_jobs=1, bin_size=None, batch_size=None):
     '''
     Fetch junction reads to create a junc file
+    Note: every junction (N operation) of a read is counted; with n_jobs
+    other than 1, reads are counted per contig (or per bin_size bins) in
+    parallel through the BAM index; with batch_size, junctions are extracted
+    from batches of reads with NumPy; see bed_to_bigbed() for BigBed
     '''
-    bamf = pysam.AlignmentFile(bam, 'rb')
     prefix = os.path.splitext(os.path.split(bam)[-1])[0]
     if not dir:
         if url:
@@ -84,26 +97,24 @@ def fetch_juncfile(bam, url=False, dir=None, uniq=False, stranded=False,
     else:
         if not os.path.isdir(dir):
             sys.exit('Your directory is wrong: %s' % dir)
-    junc_lst = defaultdict(int)
-    for read in bamf:
-        if uniq and read.get_tag('NH') != 1:
-            continue
-        if read.cigartuples and any(filter(lambda x: x[0] == 3,
-                                           read.cigartuples)):
-            npos = re.findall(r'N|D|I', read.cigarstring).index('N')
-            pos1 = read.get_blocks()[npos][1]
-            pos2 = read.get_blocks()[npos + 1][0]
-            if stranded:
-                if read.is_paired and read.is_read2:  # read2
-                    strand = '-' if read.is_reverse else '+'
-                else:  # read1
-                    strand = '+' if read.is_reverse else '-'
-            else:
-                strand = '+'
-            junc_id = '%s\t%d\t%d\t%s' % (read.reference_name, pos1, pos2,
-                                          strand)
-            junc_lst[junc_id] += 1
+    if n_jobs == 1:
+        junc_lst = _count_junc(bam, None, uniq, stranded, batch_size)
+    else:
+        if not url:
+            check_bam(bam, return_handle=False)
+        regions = _bam_regions(bam, bin_size)
+        results = Parallel(n_jobs=n_jobs)(delayed(_count_junc)(bam, region,
+                                                               uniq, stranded,
+                                                               batch_size)
+                                          for region in regions)
+        # merge in genome order, so junctions keep their serial order
+        junc_lst = defaultdict(int)
+        for result in results:
+            for junc, count in result.items():
+                junc_lst[junc] += count
     junc_path = os.path.join(dir, prefix + '_junc.bed')
+    with pysam.AlignmentFile(bam, 'rb') as bamf:
+        chrom_sizes = dict(zip(bamf.references, bamf.lengths))
     with tempfile.NamedTemporaryFile(mode='w+') as tmp:
         for junc in junc_lst:
             if junc_lst[junc] < min:
@@ -111,29 +122,201 @@ def fetch_juncfile(bam, url=False, dir=None, uniq=False, stranded=False,
             chrom, pos1, pos2, strand = junc.split()
             pos1 = int(pos1)
             pos2 = int(pos2)
-            start = pos1 - 10
+            # 10 bp anchors, clipped to the chromosome
+            start = pos1 - 10 if pos1 > 10 else 0
             end = pos2 + 10
+            if end > chrom_sizes[chrom]:
+                end = chrom_sizes[chrom]
             offset = pos2 - start
             junc_info = '%s\t%d\t%d\tjunc/%d\t0\t%s'
-            junc_info += '\t%d\t%d\t0,0,0\t2\t10,10\t0,%d\n'
+            junc_info += '\t%d\t%d\t0,0,0\t2\t%d,%d\t0,%d\n'
             tmp.write(junc_info % (chrom, start, end, junc_lst[junc],
-                                   strand, start, end, offset))
+                                   strand, start, end, pos1 - start,
+                                   end - pos2, offset))
         tmp.seek(0)
         sorted_junc_bed = pybedtools.BedTool(tmp.name).sort()
         sorted_junc_bed.saveas(junc_path)
     return junc_path
 
 
-def bam_to_bedgraph(bam, url=False, dir=None, stranded=False, scale=False):
+def bed_to_bigbed(bed, chrom_sizes, bb=None):
+    '''
+    Convert a BED12 file (e.g. from fetch_juncfile()) into a BigBed file, as
+    bedToBigBed -type=bed12 does, and return its path
+    chrom_sizes: [(chrom, size)...], e.g. zip(bamf.references, bamf.lengths)
+    bb: default is the BED path with .bb extension
+    '''
+    if bb is None:
+        bb = os.path.splitext(bed)[0] + '.bb'
+    records = []
+    with open(bed) as bed_f:
+        for line in bed_f:
+            chrom, start, end, rest = line.rstrip('\n').split('\t', 3)
+            records.append((chrom, start, end, rest))
+    write_bigbed(bb, chrom_sizes, records)
+    return bb
+
+
+def _bam_regions(bam, bin_size=None):
+    '''
+    Split reference contigs with mapped reads into (contig, start, end)
+    regions of bin_size
+    '''
+    with pysam.AlignmentFile(bam, 'rb') as bamf:
+        mapped = {stat.contig: stat.mapped
+                  for stat in bamf.get_index_statistics()}
+        lengths = [(contig, length) for contig, length in
+                   zip(bamf.references, bamf.lengths) if mapped.get(contig)]
+    regions = []
+    for contig, length in lengths:
+        step = bin_size or length
+        for start in range(0, length, step):
+            regions.append((contig, start, min(start + step, length)))
+    return regions
+
+
+def _count_junc(bam, region, uniq, stranded, batch_size=None):
+    '''
+    Count junction reads of the whole bam (region is None), or of reads
+    starting within region
+    '''
+    bamf = pysam.AlignmentFile(bam, 'rb')
+    if region is None:
+        reads = bamf
+    else:
+        contig, start, end = region
+        reads = (read for read in bamf.fetch(contig, start, end)
+                 if read.reference_start >= start)
+    if batch_size:
+        junc_lst = _count_junc_batch(bamf, reads, uniq, stranded, batch_size)
+        bamf.close()
+        return junc_lst
+    junc_lst = defaultdict(int)
+    for read in reads:
+        if uniq and read.get_tag('NH') != 1:
+            continue
+        juncs = _read_juncs(read.reference_start, read.cigartuples)
+        if not juncs:
+            continue
+        strand = _read_strand(read, stranded)
+        for pos1, pos2 in juncs:
+            junc_id = '%s\t%d\t%d\t%s' % (read.reference_name, pos1, pos2,
+                                          strand)
+            junc_lst[junc_id] += 1
+    bamf.close()
+    return junc_lst
+
+
+def _read_juncs(pos, cigartuples):
     '''
-    Convert bam file to bedgraph file
-    Note: `scale` only supports local files
+    Return every junction of a read as (start, end), i.e. gaps between
+    aligned blocks that contain N (together with adjacent D)
     '''
-    if url:  # from remote server
-        bamf = pybedtools.BedTool(bam, remote=True)
-    else:  # from local file
-        bamf = pybedtools.BedTool(bam, remote=False)
-        bam_head = check_bam(bam)
+    juncs = []
+    gap_start = None
+    spliced = False
+    for op, length in cigartuples or []:
+        if op in CIGAR_ALIGNED:
+            if spliced:
+                juncs.append((gap_start, pos))
+            gap_start = None
+            spliced = False
+            pos += length
+        elif op in CIGAR_GAP:
+            if gap_start is None:
+                gap_start = pos
+            spliced |= op == 3
+            pos += length
+    return juncs
+
+
+def _read_strand(read, stranded):
+    if stranded:
+        if read.is_paired and read.is_read2:  # read2
+            return '-' if read.is_reverse else '+'
+        else:  # read1
+            return '+' if read.is_reverse else '-'
+    else:
+        return '+'
+
+
+def _count_junc_batch(bamf, reads, uniq, stranded, batch_size):
+    '''
+    Count junction reads as _count_junc does, but extract junctions of
+    batch_size spliced reads at a time with NumPy
+    '''
+    keys = []  # (reference id, start, end, strand) arrays of every batch
+    batch = []
+    for read in reads:
+        if uniq and read.get_tag('NH') != 1:
+            continue
+        cigar = read.cigartuples
+        if not cigar or not any(op == 3 for op, _ in cigar):
+            continue
+        batch.append((read.reference_id, read.reference_start,
+                      _read_strand(read, stranded) == '-', cigar))
+        if len(batch) == batch_size:
+            keys.append(_batch_juncs(batch))
+            batch = []
+    if batch:
+        keys.append(_batch_juncs(batch))
+    junc_lst = defaultdict(int)
+    if not keys:
+        return junc_lst
+    ref, start, end, minus = (np.concatenate(k) for k in zip(*keys))
+    order = np.lexsort((minus, end, start, ref))
+    columns = (ref[order], start[order], end[order], minus[order])
+    new = np.ones(len(order), dtype=bool)
+    new[1:] = np.any([c[1:] != c[:-1] for c in columns], axis=0)
+    groups = np.cumsum(new) - 1
+    counts = np.bincount(groups)
+    first = np.full(len(counts), len(order))
+    np.minimum.at(first, groups, order)
+    # keep junctions in the order they are first seen, as _count_junc does
+    for g in np.argsort(first, kind='stable'):
+        k = first[g]
+        junc_id = '%s\t%d\t%d\t%s' % (bamf.get_reference_name(int(ref[k])),
+                                      start[k], end[k],
+                                      '-' if minus[k] else '+')
+        junc_lst[junc_id] = int(counts[g])
+    return junc_lst
+
+
+def _batch_juncs(batch):
+    '''
+    Vectorized _read_juncs of a batch of (reference id, start, minus,
+    cigartuples)
+    '''
+    n_ops = np.array([len(b[3]) for b in batch])
+    cigar = np.array([op for b in batch for op in b[3]], dtype=np.int64)
+    ops, lengths = cigar[:, 0], cigar[:, 1]
+    read = np.repeat(np.arange(len(batch)), n_ops)
+    consumed = np.where(np.isin(ops, CIGAR_ALIGNED + CIGAR_GAP), lengths, 0)
+    cum = np.cumsum(consumed)
+    read_first = np.cumsum(n_ops) - n_ops
+    starts = np.array([b[1] for b in batch], dtype=np.int64)
+    pos = starts[read] + cum - consumed - (cum - consumed)[read_first][read]
+    n_count = np.cumsum(ops == 3)
+    # consecutive aligned blocks of the same read with N between them
+    aligned = np.flatnonzero(np.isin(ops, CIGAR_ALIGNED))
+    prev, curr = aligned[:-1], aligned[1:]
+    junc = (read[prev] == read[curr]) & (n_count[curr] > n_count[prev])
+    prev, curr = prev[junc], curr[junc]
+    ref = np.array([b[0] for b in batch], dtype=np.int64)
+    minus = np.array([b[2] for b in batch], dtype=bool)
+    return (ref[read[curr]], pos[prev] + lengths[prev], pos[curr],
+            minus[read[curr]])
+
+
+def bam_to_bedgraph(bam, url=False, dir=None, stranded=False, scale=False,
+                    n_jobs=1, bigwig=False):
+    '''
+    Convert bam file to bedgraph file (or BigWig file if bigwig is True)
+    Note: `scale` only supports local files; coverage is computed per
+    chromosome, with n_jobs chromosomes in parallel
+    '''
+    if not url:  # from local file
+        check_bam(bam, return_handle=False)
     prefix = os.path.splitext(os.path.split(bam)[-1])[0]
     if not dir:
         if url:
@@ -143,45 +326,515 @@ def bam_to_bedgraph(bam, url=False, dir=None, stranded=False, scale=False):
     else:
         if not os.path.isdir(dir):
             sys.exit('Your directory is wrong: %s' % dir)
-    chrom_size_f = tempfile.NamedTemporaryFile('w+')
-    for seq in bam_head.header['SQ']:
-        chrom_size_f.write('%s\t%s\n' % (seq['SN'], seq['LN']))
-    chrom_size_f.seek(0)
-    chrom_size_fn = chrom_size_f.name
     if scale and not url:
-        mapped_reads = bam_head.mapped
-        for read in bam_head:
-            read_length = read.query_length
-            break
+        with pysam.AlignmentFile(bam, 'rb') as bam_head:
+            mapped_reads = bam_head.mapped
+            for read in bam_head:
+                read_length = read.query_length
+                break
         s = 1000000000.0 / mapped_reads / read_length
     else:
         s = 1
+    suffix = '.bw' if bigwig else '.bg'
     if stranded:
-        bedgraph_pfn = os.path.join(dir, prefix + '_plusS.bg')
-        bedgraph_mfn = os.path.join(dir, prefix + '_minusS.bg')
-        _cal_cov(bedgraph_pfn, bamf, chrom_size_fn, s, strand='+')
-        _cal_cov(bedgraph_mfn, bamf, chrom_size_fn, s, strand='-')
-    else:
-        bedgraph_fn = os.path.join(dir, prefix + '.bg')
-        _cal_cov(bedgraph_fn, bamf, chrom_size_fn, s)
-    chrom_size_f.close()
-    if stranded:
+        bedgraph_pfn = os.path.join(dir, prefix + '_plusS' + suffix)
+        bedgraph_mfn = os.path.join(dir, prefix + '_minusS' + suffix)
+        # for TruSeq kit, reverse reads are counted onto plus strand, and
+        # minus strand coverage is negative; both in a single pass
+        _cal_cov([bedgraph_pfn, bedgraph_mfn], bam, [(True, s), (False, -s)],
+                 n_jobs, bigwig)
         return (bedgraph_pfn, bedgraph_mfn)
     else:
+        bedgraph_fn = os.path.join(dir, prefix + suffix)
+        _cal_cov([bedgraph_fn], bam, [(None, s)], n_jobs, bigwig)
         return bedgraph_fn
 
 
-def _cal_cov(bedgraph_fn, bamf, chrom_size_fn, scale, strand=None):
-    opt = {'bg': True, 'g': chrom_size_fn, 'split': True, 'scale': scale}
-    if strand == '+':
-        opt['strand'] = '-'  # for TruSeq kit
-    elif strand == '-':
-        opt['strand'] = '+'  # for TruSeq kit
-        opt['scale'] *= -1
-    with open(bedgraph_fn, 'w') as bedgraph_f:
-        for line in bamf.genome_coverage(**opt):
-            value = str(int(float(line[3]) + 0.5))
-            bedgraph_f.write('\t'.join(line[:3]) + '\t%s\n' % value)
+def _cal_cov(bedgraph_fns, bam, tracks, n_jobs, bigwig=False):
+    '''
+    Write a bedgraph (or BigWig) file for each (reverse, scale) track, see
+    _chrom_coverage()
+    '''
+    contigs = [region[0] for region in _bam_regions(bam)]
+    if n_jobs == 1:
+        results = (_chrom_coverage(bam, contig, tracks) for contig in contigs)
+    else:
+        results = Parallel(n_jobs=n_jobs)(delayed(_chrom_coverage)(bam,
+                                                                   contig,
+                                                                   tracks)
+                                          for contig in contigs)
+    if bigwig:
+        results = list(results)
+        with pysam.AlignmentFile(bam, 'rb') as bamf:
+            chrom_sizes = list(zip(bamf.references, bamf.lengths))
+        for n, bigwig_fn in enumerate(bedgraph_fns):
+            write_bigwig(bigwig_fn, chrom_sizes,
+                         [(contig,) + result[n]
+                          for contig, result in zip(contigs, results)])
+        return
+    with contextlib.ExitStack() as stack:
+        bedgraph_fs = [stack.enter_context(open(fn, 'w'))
+                       for fn in bedgraph_fns]
+        for contig, result in zip(contigs, results):
+            for bedgraph_f, (starts, ends, values) in zip(bedgraph_fs,
+                                                          result):
+                bedgraph_f.writelines('%s\t%d\t%d\t%d\n' %
+                                      (contig, sta, end, v)
+                                      for sta, end, v in
+                                      zip(starts.tolist(), ends.tolist(),
+                                          values.tolist()))
+
+
+def _chrom_coverage(bam, contig, tracks):
+    '''
+    Compute split (spliced) read coverage of a chromosome for every
+    (reverse, scale) track in one pass, the same as `bedtools genomecov -bg
+    -split -scale`, and round scaled depth like int(depth * scale + 0.5)
+    Note: reverse is None for all reads, otherwise only reads with the
+    same is_reverse flag are counted
+    '''
+    # blocks are buffered in small lists, and flushed into aggregated
+    # (position, depth change) events of every track
+    blocks = [([], []) for _ in tracks]
+    events = [None for _ in tracks]
+    with pysam.AlignmentFile(bam, 'rb') as bamf:
+        length = bamf.get_reference_length(contig)
+        read_starts, read_ends = [], []
+        for read in bamf.fetch(contig):
+            if read.is_unmapped:
+                continue
+            del read_starts[:], read_ends[:]
+            _read_blocks(read.reference_start, read.cigartuples, read_starts,
+                         read_ends)
+            for n, ((reverse, _), (starts, ends)) in enumerate(zip(tracks,
+                                                                   blocks)):
+                if reverse is None or read.is_reverse == reverse:
+                    starts.extend(read_starts)
+                    ends.extend(read_ends)
+                    if len(starts) >= COVERAGE_CHUNK:
+                        events[n] = _add_events(events[n], starts, ends,
+                                                length)
+                        del starts[:], ends[:]
+    results = []
+    for (_, scale), (starts, ends), event in zip(tracks, blocks, events):
+        starts, ends, depth = _depth_runs(*_add_events(event, starts, ends,
+                                                       length))
+        results.append((starts, ends, _round_depth(depth, scale)))
+    return results
+
+
+def _add_events(events, starts, ends, length=None):
+    '''
+    Merge blocks into (positions, depth changes) events, aggregated per
+    position; blocks are clipped to length if it is given
+    '''
+    starts = np.array(starts, dtype=np.int64)
+    ends = np.array(ends, dtype=np.int64)
+    if length is not None:
+        starts, ends = np.minimum(starts, length), np.minimum(ends, length)
+    pos = [starts, ends]
+    delta = [np.ones(len(starts), dtype=np.int64),
+             -np.ones(len(ends), dtype=np.int64)]
+    if events is not None:
+        pos.append(events[0])
+        delta.append(events[1])
+    pos, index = np.unique(np.concatenate(pos), return_inverse=True)
+    delta = np.bincount(index, weights=np.concatenate(delta),
+                        minlength=len(pos)).astype(np.int64)
+    keep = delta != 0
+    return pos[keep], delta[keep]
+
+
+def _read_blocks(pos, cigartuples, starts, ends):
+    '''
+    Append blocks of a read split at N (but not D) onto starts and ends
+    '''
+    sta = pos
+    for op, length in cigartuples or []:
+        if op == 3:
+            if sta < pos:
+                starts.append(sta)
+                ends.append(pos)
+            pos += length
+            sta = pos
+        elif op in CIGAR_ALIGNED or op == 2:
+            pos += length
+    if sta < pos:
+        starts.append(sta)
+        ends.append(pos)
+
+
+def _depth_runs(pos, delta):
+    '''
+    Return (starts, ends, depth) of runs with the same non-zero depth, from
+    events of _add_events()
+    '''
+    bp, depth = _sweep_depth(pos, delta)
+    if len(bp) < 2:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty
+    run = np.concatenate(([True], depth[1:] != depth[:-1]))
+    run_starts = bp[:-1][run]
+    run_ends = np.append(run_starts[1:], bp[-1])
+    depth = depth[run]
+    keep = depth != 0
+    return run_starts[keep], run_ends[keep], depth[keep]
+
+
+def _round_depth(depth, scale):
+    '''
+    Round scaled depth as int(float(x) + 0.5), where x is printed by bedtools
+    with 6 significant digits
+    '''
+    value = depth * float(scale)
+    rounded = np.trunc(value + 0.5).astype(np.int64)
+    if scale != 1:
+        # recheck values whose rounding may depend on the printed digits
+        frac = np.abs(value - np.floor(value) - 0.5)
+        for i in np.flatnonzero(frac <= np.abs(value) * 1e-5):
+            rounded[i] = int(float('%g' % value[i]) + 0.5)
+    return rounded
+
+
+BIGWIG_MAGIC = 0x888FFC26
+BIGBED_MAGIC = 0x8789F2EB
+BPT_MAGIC = 0x78CA8C91
+CIRTREE_MAGIC = 0x2468ACE0
+BBI_BLOCK_SIZE = 256
+BBI_ZOOM_LEVELS = 10
+BBI_ZOOM_INCREMENT = 4
+BED12_AUTOSQL = """table bed
+"Browser Extensible Data"
+    (
+    string chrom;       "Reference sequence chromosome or scaffold"
+    uint   chromStart;  "Start position in chromosome"
+    uint   chromEnd;    "End position in chromosome"
+    string name;        "Name of item"
+    uint score;         "Score from 0-1000"
+    char[1] strand;     "+ or -"
+    uint thickStart;    "Start of where display should be thick"
+    uint thickEnd;      "End of where display should be thick"
+    uint reserved;      "Used as itemRgb"
+    int blockCount;     "Number of blocks"
+    int[blockCount] blockSizes; "Comma separated list of block sizes"
+    int[blockCount] chromStarts; "Start positions relative to chromStart"
+    )
+"""
+
+
+def write_bigwig(bw_fn, chrom_sizes, coverage, items_per_slot=1024):
+    '''
+    Write bedgraph-style coverage into an indexed BigWig file with zoom
+    levels, as bedGraphToBigWig does
+    chrom_sizes: [(chrom, size)...], e.g. zip(bamf.references, bamf.lengths)
+    coverage: [(chrom, starts, ends, values)...], sorted non-overlapping
+              intervals of every chromosome
+    '''
+    data = {}
+    for chrom, starts, ends, values in coverage:
+        if len(starts):
+            data[chrom] = (np.asarray(starts, dtype=np.int64),
+                           np.asarray(ends, dtype=np.int64),
+                           np.asarray(values, dtype=np.float64))
+    chroms, sizes = _bbi_chroms(chrom_sizes, data)
+    blocks, zoom_source = [], []
+    for cid, chrom in enumerate(chroms):
+        starts, ends, values = data[chrom]
+        for i in range(0, len(starts), items_per_slot):
+            s, e = starts[i:i + items_per_slot], ends[i:i + items_per_slot]
+            items = np.empty(len(s), dtype=[('start', '<u4'), ('end', '<u4'),
+                                            ('value', '<f4')])
+            items['start'], items['end'] = s, e
+            items['value'] = values[i:i + items_per_slot]
+            header = struct.pack('<IIIIIBBH', cid, s[0], e[-1], 0, 0, 1, 0,
+                                 len(s))
+            blocks.append((cid, int(s[0]), int(e.max()),
+                           header + items.tobytes()))
+        zoom_source.append((starts, ends, values))
+    _bbi_write(bw_fn, BIGWIG_MAGIC, chroms, sizes, blocks, zoom_source,
+               items_per_slot)
+
+
+def write_bigbed(bb_fn, chrom_sizes, records, items_per_slot=512):
+    '''
+    Write BED12 records into an indexed BigBed file with zoom levels, as
+    bedToBigBed -type=bed12 does
+    chrom_sizes: [(chrom, size)...]
+    records: [(chrom, start, end, rest)...], rest is the tab-separated text
+             of the other 9 columns
+    '''
+    data = defaultdict(list)
+    for chrom, start, end, rest in records:
+        data[chrom].append((int(start), int(end), rest))
+    chroms, sizes = _bbi_chroms(chrom_sizes, data)
+    for chrom, size in zip(chroms, sizes):
+        for start, end, _ in data[chrom]:
+            if not 0 <= start <= end <= size:
+                sys.exit('Error: %s:%d-%d is out of the chromosome (size: '
+                         '%d)!' % (chrom, start, end, size))
+    blocks, zoom_source = [], []
+    for cid, chrom in enumerate(chroms):
+        items = sorted(data[chrom], key=lambda x: (x[0], x[1]))
+        for i in range(0, len(items), items_per_slot):
+            chunk = items[i:i + items_per_slot]
+            block = b''.join(struct.pack('<III', cid, start, end) +
+                             rest.encode() + b'\0'
+                             for start, end, rest in chunk)
+            blocks.append((cid, chunk[0][0], max(x[1] for x in chunk),
+                           block))
+        # zoom levels summarize how many items cover each base
+        starts, ends, depth = _depth_runs(*_add_events(
+            None, [x[0] for x in items], [x[1] for x in items]))
+        zoom_source.append((starts, ends, depth.astype(np.float64)))
+    _bbi_write(bb_fn, BIGBED_MAGIC, chroms, sizes, blocks, zoom_source,
+               items_per_slot, field_count=12, autosql=BED12_AUTOSQL,
+               data_count=sum(len(data[chrom]) for chrom in chroms))
+
+
+def _bbi_chroms(chrom_sizes, data):
+    '''
+    Return chromosomes with data sorted by name (their chromosome IDs), and
+    their sizes
+    '''
+    sizes = dict(chrom_sizes)
+    missing = [chrom for chrom in data if chrom not in sizes]
+    if missing:
+        sys.exit('No size of chromosome: %s!' % missing[0])
+    chroms = sorted(data, key=lambda c: c.encode())
+    return chroms, [sizes[chrom] for chrom in chroms]
+
+
+def _bbi_write(fn, magic, chroms, sizes, blocks, zoom_source,
+               items_per_slot, field_count=0, autosql=None, data_count=None):
+    '''
+    Write a BigWig/BigBed file from data blocks [(chrom ID, start, end,
+    uncompressed bytes)...] and zoom_source [(starts, ends, values)...] of
+    every chromosome
+    data_count: the number of BED items for BigBed, or None for the number of
+                data blocks (BigWig)
+    '''
+    if data_count is None:
+        data_count = len(blocks)
+    zooms = _bbi_zoom_levels(sizes, zoom_source, items_per_slot)
+    buf_size = max([len(b[3]) for b in blocks] +
+                   [len(b[3]) for _, zoom_blocks in zooms
+                    for b in zoom_blocks] + [0])
+    with open(fn, 'wb') as f:
+        f.write(b'\0' * (64 + 24 * len(zooms)))
+        autosql_offset = 0
+        if autosql is not None:
+            autosql_offset = f.tell()
+            f.write(autosql.encode() + b'\0')
+        summary_offset = f.tell()
+        f.write(_bbi_total_summary(zoom_source))
+        chrom_tree_offset = f.tell()
+        _bpt_write(f, chroms, sizes)
+        data_offset = f.tell()
+        f.write(struct.pack('<Q', data_count))
+        index_offset, index_items = _bbi_write_blocks(f, blocks)
+        _cirtree_write(f, index_items, index_offset, items_per_slot)
+        zoom_headers = []
+        for reduction, zoom_blocks in zooms:
+            zoom_data_offset = f.tell()
+            f.write(struct.pack('<I', sum(len(b[3]) // 32
+                                          for b in zoom_blocks)))
+            zoom_index_offset, items = _bbi_write_blocks(f, zoom_blocks)
+            _cirtree_write(f, items, zoom_index_offset, items_per_slot)
+            zoom_headers.append(struct.pack('<IIQQ', reduction, 0,
+                                            zoom_data_offset,
+                                            zoom_index_offset))
+        f.write(struct.pack('<I', magic))
+        f.seek(0)
+        f.write(struct.pack('<IHHQQQHHQQIQ', magic, 4, len(zooms),
+                            chrom_tree_offset, data_offset, index_offset,
+                            field_count, field_count, autosql_offset,
+                            summary_offset, buf_size, 0))
+        f.write(b''.join(zoom_headers))
+
+
+def _bbi_write_blocks(f, blocks):
+    '''
+    Write zlib compressed blocks, and return the offset after them and
+    their R-tree index items
+    '''
+    items = []
+    for cid, start, end, block in blocks:
+        offset = f.tell()
+        f.write(zlib.compress(block))
+        items.append((cid, start, cid, end, offset, f.tell() - offset))
+    return f.tell(), items
+
+
+def _bbi_total_summary(zoom_source):
+    covered, low, high, total, squares = 0, np.inf, -np.inf, 0.0, 0.0
+    for starts, ends, values in zoom_source:
+        if not len(starts):
+            continue
+        span = ends - starts
+        covered += int(span.sum())
+        low, high = min(low, values.min()), max(high, values.max())
+        total += float((values * span).sum())
+        squares += float((values * values * span).sum())
+    if not covered:
+        low = high = 0
+    return struct.pack('<Qdddd', covered, low, high, total, squares)
+
+
+def _bbi_zoom_levels(sizes, zoom_source, items_per_slot):
+    '''
+    Return [(reduction, blocks)...] of zoom levels; every level is
+    BBI_ZOOM_INCREMENT times coarser and at least halves the records
+    '''
+    count = sum(len(starts) for starts, _, _ in zoom_source)
+    if not count:
+        return []
+    span = sum(int((ends - starts).sum()) for starts, ends, _ in zoom_source)
+    reduction = max(10 * span // count, 1)
+    zooms = []
+    for _ in range(BBI_ZOOM_LEVELS):
+        if reduction >= 2 ** 32:
+            break
+        summaries = [_bbi_summary(cid, starts, ends, values, reduction,
+                                  size)
+                     for cid, ((starts, ends, values), size) in
+                     enumerate(zip(zoom_source, sizes))]
+        zoom_count = sum(len(records) for records in summaries)
+        if zoom_count * 2 <= count:
+            blocks = []
+            for cid, records in enumerate(summaries):
+                for i in range(0, len(records), items_per_slot):
+                    chunk = records[i:i + items_per_slot]
+                    blocks.append((cid, int(chunk['start'][0]),
+                                   int(chunk['end'][-1]), chunk.tobytes()))
+            zooms.append((reduction, blocks))
+            count = zoom_count
+        if zoom_count <= len(sizes):  # one record per chromosome
+            break
+        reduction *= BBI_ZOOM_INCREMENT
+    return zooms
+
+
+def _bbi_summary(cid, starts, ends, values, reduction, size):
+    '''
+    Summarize sorted non-overlapping intervals of a chromosome into bins of
+    reduction bases
+    '''
+    first, last = starts // reduction, (ends - 1) // reduction
+    n = last - first + 1
+    item = np.repeat(np.arange(len(starts)), n)
+    bins = first[item] + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    overlap = np.minimum(ends[item], (bins + 1) * reduction) - \
+        np.maximum(starts[item], bins * reduction)
+    value = values[item]
+    new = np.flatnonzero(np.concatenate(([True], bins[1:] != bins[:-1])))
+    records = np.empty(len(new), dtype=[('chrom', '<u4'), ('start', '<u4'),
+                                        ('end', '<u4'), ('valid', '<u4'),
+                                        ('min', '<f4'), ('max', '<f4'),
+                                        ('sum', '<f4'), ('squares', '<f4')])
+    records['chrom'] = cid
+    records['start'] = bins[new] * reduction
+    records['end'] = np.minimum((bins[new] + 1) * reduction, size)
+    records['valid'] = np.add.reduceat(overlap, new)
+    records['min'] = np.minimum.reduceat(value, new)
+    records['max'] = np.maximum.reduceat(value, new)
+    records['sum'] = np.add.reduceat(value * overlap, new)
+    records['squares'] = np.add.reduceat(value * value * overlap, new)
+    return records
+
+
+def _bpt_write(f, chroms, sizes):
+    '''
+    Write the chromosome B+ tree (name -> chromosome ID and size)
+    '''
+    keys = [chrom.encode() for chrom in chroms]
+    key_size = max([len(key) for key in keys] + [1])
+    block_size = max(min(BBI_BLOCK_SIZE, len(keys)), 1)
+    f.write(struct.pack('<IIIIQQ', BPT_MAGIC, block_size, key_size, 8,
+                        len(keys), 0))
+    leaves = [[(key.ljust(key_size, b'\0'), struct.pack('<II', cid, size))
+               for cid, (key, size) in enumerate(zip(keys[i:i + block_size],
+                                                     sizes[i:i + block_size]),
+                                                 i)]
+              for i in range(0, max(len(keys), 1), block_size)]
+    levels = [leaves]
+    while len(levels[-1]) > 1:
+        below = levels[-1]
+        levels.append([below[i:i + block_size]
+                       for i in range(0, len(below), block_size)])
+    node_size = 4 + block_size * (key_size + 8)
+    offset = f.tell()
+    starts = []
+    for level in reversed(levels):  # root first
+        starts.append(offset)
+        offset += len(level) * node_size
+    for depth, level in enumerate(reversed(levels)):
+        is_leaf = depth == len(levels) - 1
+        child = 0
+        for node in level:
+            f.write(struct.pack('<BBH', is_leaf, 0, len(node)))
+            for item in node:
+                if is_leaf:
+                    f.write(item[0] + item[1])
+                else:
+                    first = item
+                    while type(first) is list:  # first key of the subtree
+                        first = first[0]
+                    f.write(first[0] + struct.pack(
+                        '<Q', starts[depth + 1] + child * node_size))
+                    child += 1
+            f.write(b'\0' * (block_size - len(node)) * (key_size + 8))
+
+
+def _cirtree_write(f, items, end_offset, items_per_slot):
+    '''
+    Write the R-tree index of data blocks [(start chrom ID, start, end
+    chrom ID, end, offset, size)...]
+    '''
+    block_size = BBI_BLOCK_SIZE
+    if items:
+        bounds = (items[0][0], items[0][1], max((x[2], x[3]) for x in items))
+    else:
+        bounds = (0, 0, (0, 0))
+    f.write(struct.pack('<IIQIIIIQII', CIRTREE_MAGIC, block_size, len(items),
+                        bounds[0], bounds[1], bounds[2][0], bounds[2][1],
+                        end_offset, items_per_slot, 0))
+    levels = [[items[i:i + block_size]
+               for i in range(0, max(len(items), 1), block_size)]]
+    while len(levels[-1]) > 1:
+        below = levels[-1]
+        levels.append([[_cirtree_bounds(node) for node in
+                        below[i:i + block_size]]
+                       for i in range(0, len(below), block_size)])
+    offset = f.tell()
+    starts = []
+    for depth, level in enumerate(reversed(levels)):
+        starts.append(offset)
+        is_leaf = depth == len(levels) - 1
+        offset += len(level) * (4 + block_size * (32 if is_leaf else 24))
+    for depth, level in enumerate(reversed(levels)):
+        is_leaf = depth == len(levels) - 1
+        child_size = 4 + block_size * (32 if depth + 2 == len(levels) else 24)
+        child = 0
+        for node in level:
+            f.write(struct.pack('<BBH', is_leaf, 0, len(node)))
+            for item in node:
+                if is_leaf:
+                    f.write(struct.pack('<IIIIQQ', *item))
+                else:
+                    f.write(struct.pack('<IIIIQ', item[0], item[1], item[2],
+                                        item[3], starts[depth + 1] +
+                                        child * child_size))
+                    child += 1
+            f.write(b'\0' * (block_size - len(node)) *
+                    (32 if is_leaf else 24))
+
+
+def _cirtree_bounds(node):
+    '''
+    Return bounds (start chrom ID, start, end chrom ID, end) of a node
+    '''
+    end = max((item[2], item[3]) for item in node)
+    return (node[0][0], node[0][1], end[0], end[1])
 
 
 if __name__ == '__main__':
@@ -3,23 +3,127 @@ Functions and classes to fetch information
 '''
 
 import sys
+import os
+import re
+import io
+import gzip
+import signal
+import subprocess
+import shutil
+import tempfile
+import warnings
+from array import array
+from urllib.parse import unquote
+import numpy as np
+from joblib import Parallel, delayed
 from future.utils import implements_iterator
-from .interval import Interval
+from .interval import Interval, IntervalIndex
 
 __author__ = 'Xiao-Ou Zhang <kepbod@gmail.com>'
-__all__ = ['Annotation', 'Junc']
+__all__ = ['Annotation', 'Junc', 'load_annotation', 'parse_gtf',
+           'load_star_junc', 'junc_matrix', 'load_annotation_index',
+           'read_annotation', 'read_junc', 'read_junc_files',
+           'TranscriptMapper']
+
+
+BLOCK_SIZE = 1 << 22  # 4 MiB
+
+
+class _PipeReader(io.TextIOWrapper):
+    '''
+    Text stream over the stdout of a decompressing subprocess.
+    '''
+
+    def __init__(self, command):
+        self._command = command
+        self._proc = subprocess.Popen(command, stdout=subprocess.PIPE)
+        super(_PipeReader, self).__init__(self._proc.stdout)
+
+    def read(self, size=-1):
+        data = super(_PipeReader, self).read(size)
+        if not data:  # EOF, so that corrupt input fails before close()
+            self._check()
+        return data
+
+    def close(self):
+        if self.closed:
+            return
+        super(_PipeReader, self).close()
+        self._check()
+
+    def _check(self):
+        # SIGPIPE only means the stream was closed before the end
+        if self._proc.wait() not in (0, -signal.SIGPIPE):
+            sys.exit('Error: %s exited with code %d!' %
+                     (' '.join(self._command), self._proc.returncode))
+
+
+def _is_gzip(fname):
+    with open(fname, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'
+
+
+def _open_text(fname):
+    '''
+    Open plain text or gzip/bgzip compressed text for reading. Compressed
+    files are piped through pigz (multi-threaded) if it is installed.
+    '''
+    if not _is_gzip(fname):
+        return open(fname, 'r')
+    if shutil.which('pigz'):
+        return _PipeReader(['pigz', '-dc', fname])
+    return gzip.open(fname, 'rt')
+
+
+def _read_lines(fh, block_size=BLOCK_SIZE):
+    '''
+    Yield lines (without newline) by reading large blocks and splitting them
+    in bulk.
+    '''
+    rest = ''
+    while True:
+        block = fh.read(block_size)
+        if not block:
+            break
+        lines = (rest + block).split('\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line
+    if rest:
+        yield rest
 
 
 class Info(object):
 
+    __slots__ = ('_type', '_gene', '_isoform', '_chrom', '_strand',
+                 '_tx_start', '_tx_end', '_cds_start', '_cds_end', '_exon_num',
+                 '_exon_starts', '_exon_ends')
+
     def __init__(self, info, ftype='ref'):
+        # all the fields are decoded once, exons into compact arrays
         if ftype == 'ref':
             assert len(info) == 11, 'REF format should have 11 columns'
+            self._gene, self._isoform, self._chrom, self._strand = info[:4]
+            self._tx_start, self._tx_end = int(info[4]), int(info[5])
+            self._exon_num = int(info[8])
+            self._exon_starts = _int_array(info[9])
+            self._exon_ends = _int_array(info[10])
         elif ftype == 'bed':
             assert len(info) == 12, 'BED format should have 12 columns'
+            self._chrom = info[0]
+            self._gene = self._isoform = info[3]
+            self._strand = info[5]
+            self._tx_start, self._tx_end = int(info[1]), int(info[2])
+            self._exon_num = int(info[9])
+            tx_start = self._tx_start
+            self._exon_starts = array('l', [tx_start + x for x in
+                                            _int_array(info[11])])
+            self._exon_ends = array('l', [start + size for start, size in
+                                          zip(self._exon_starts,
+                                              _int_array(info[10]))])
         else:
             sys.exit('Wrong format!')
-        self._info = info
+        self._cds_start, self._cds_end = int(info[6]), int(info[7])
         self._type = ftype
 
     @property
@@ -37,10 +141,7 @@ class Info(object):
         >>> info.gene
         'uc010nxq.1'
         '''
-        if self._type == 'ref':
-            return self._info[0]
-        else:
-            return self._info[3]
+        return self._gene
 
     @property
     def isoform(self):
@@ -57,10 +158,7 @@ class Info(object):
         >>> info.isoform
         'uc010nxq.1'
         '''
-        if self._type == 'ref':
-            return self._info[1]
-        else:
-            return self._info[3]
+        return self._isoform
 
     @property
     def name(self):
@@ -74,7 +172,7 @@ class Info(object):
         if self._type == 'ref':
             sys.exit('ERROR: Ref does not have name entry!')
         else:
-            return self._info[3]
+            return self._gene
 
     @property
     def chrom(self):
@@ -91,10 +189,7 @@ class Info(object):
         >>> info.chrom
         'chr1'
         '''
-        if self._type == 'ref':
-            return self._info[2]
-        else:
-            return self._info[0]
+        return self._chrom
 
     @property
     def strand(self):
@@ -111,10 +206,7 @@ class Info(object):
         >>> info.strand
         '+'
         '''
-        if self._type == 'ref':
-            return self._info[3]
-        else:
-            return self._info[5]
+        return self._strand
 
     @property
     def tx_start(self):
@@ -131,10 +223,7 @@ class Info(object):
         >>> info.tx_start
         11873
         '''
-        if self._type == 'ref':
-            return int(self._info[4])
-        else:
-            return int(self._info[1])
+        return self._tx_start
 
     @property
     def tx_end(self):
@@ -151,10 +240,7 @@ class Info(object):
         >>> info.tx_end
         14409
         '''
-        if self._type == 'ref':
-            return int(self._info[5])
-        else:
-            return int(self._info[2])
+        return self._tx_end
 
     @property
     def total_length(self):
@@ -188,7 +274,7 @@ class Info(object):
         >>> info.cds_start
         12189
         '''
-        return int(self._info[6])
+        return self._cds_start
 
     @property
     def cds_end(self):
@@ -205,7 +291,7 @@ class Info(object):
         >>> info.cds_end
         13639
         '''
-        return int(self._info[7])
+        return self._cds_end
 
     @property
     def exon_num(self):
@@ -222,10 +308,7 @@ class Info(object):
         >>> info.exon_num
         3
         '''
-        if self._type == 'ref':
-            return int(self._info[8])
-        else:
-            return int(self._info[9])
+        return self._exon_num
 
     @property
     def intron_num(self):
@@ -259,11 +342,7 @@ class Info(object):
         >>> info.exon_starts
         [11873, 12594, 13402]
         '''
-        if self._type == 'ref':
-            return [int(x) for x in self._info[9].rstrip(',').split(',')]
-        else:
-            offsets = [int(x) for x in self._info[11].rstrip(',').split(',')]
-            return [self.tx_start + x for x in offsets]
+        return self._exon_starts.tolist()
 
     @property
     def exon_ends(self):
@@ -280,12 +359,7 @@ class Info(object):
         >>> info.exon_ends
         [12227, 12721, 14409]
         '''
-        if self._type == 'ref':
-            return [int(x) for x in self._info[10].rstrip(',').split(',')]
-        else:
-            sizes = [int(x) for x in self._info[10].rstrip(',').split(',')]
-            return [start + size for start, size in zip(self.exon_starts,
-                                                        sizes)]
+        return self._exon_ends.tolist()
 
     @property
     def exon_lengths(self):
@@ -302,11 +376,8 @@ class Info(object):
         >>> info.exon_lengths
         [354, 127, 1007]
         '''
-        if self._type == 'ref':
-            return [end - start for start, end in zip(self.exon_starts,
-                                                      self.exon_ends)]
-        else:
-            return [int(x) for x in self._info[10].rstrip(',').split(',')]
+        return [end - start for start, end in zip(self._exon_starts,
+                                                  self._exon_ends)]
 
     @property
     def mRNA_length(self):
@@ -335,7 +406,7 @@ class Info(object):
         >>> info.intron_starts
         [12227, 12721]
         '''
-        return self.exon_ends[:-1]
+        return self._exon_ends[:-1].tolist()
 
     @property
     def intron_ends(self):
@@ -352,7 +423,7 @@ class Info(object):
         >>> info.intron_ends
         [12594, 13402]
         '''
-        return self.exon_starts[1:]
+        return self._exon_starts[1:].tolist()
 
     @property
     def intron_lengths(self):
@@ -369,8 +440,8 @@ class Info(object):
         >>> info.intron_lengths
         [367, 681]
         '''
-        return [end - start for start, end in zip(self.intron_starts,
-                                                  self.intron_ends)]
+        return [end - start for start, end in zip(self._exon_ends[:-1],
+                                                  self._exon_starts[1:])]
 
     @property
     def utr5_regions(self):
@@ -385,8 +456,8 @@ class Info(object):
         if self.cds_start == self.cds_end:
             return []
         exon_regions = [[start, end]
-                        for start, end in zip(self.exon_starts,
-                                              self.exon_ends)]
+                        for start, end in zip(self._exon_starts,
+                                              self._exon_ends)]
         if self.strand == '+':
             return Interval.split(exon_regions, self.cds_start, self.cds_end,
                                   flag='left')
@@ -407,8 +478,8 @@ class Info(object):
         if self.cds_start == self.cds_end:
             return []
         exon_regions = [[start, end]
-                        for start, end in zip(self.exon_starts,
-                                              self.exon_ends)]
+                        for start, end in zip(self._exon_starts,
+                                              self._exon_ends)]
         if self.strand == '+':
             return Interval.split(exon_regions, self.cds_start, self.cds_end,
                                   flag='right')
@@ -429,12 +500,690 @@ class Info(object):
         if self.cds_start == self.cds_end:
             return []
         exon_regions = [[start, end]
-                        for start, end in zip(self.exon_starts,
-                                              self.exon_ends)]
+                        for start, end in zip(self._exon_starts,
+                                              self._exon_ends)]
         return Interval.split(exon_regions, self.cds_start, self.cds_end,
                               flag='middle')
 
 
+def _int_array(field):
+    '''
+    Decode comma separated integers into array('l').
+    '''
+    return array('l', [int(x) for x in field.rstrip(',').split(',')])
+
+
+FEATURES = ('TSS', 'TES', 'exon', 'intron', '5UTR', 'CDS', '3UTR', 'gene')
+FEATURE_REGIONS = {'exon': 'exon_regions', 'intron': 'intron_regions',
+                   '5UTR': 'utr5_regions', 'CDS': 'cds_regions',
+                   '3UTR': 'utr3_regions'}
+
+
+class AnnotationTable(object):
+    '''
+    Whole annotation in columns, see load_annotation().
+
+    Attributes: gene, isoform, chrom, strand (str arrays),
+                tx_start, tx_end, cds_start, cds_end (int64 arrays),
+                exon_starts, exon_ends (int64 arrays of all the exons),
+                exon_offsets (exons of transcript i are
+                exon_starts[exon_offsets[i]:exon_offsets[i + 1]])
+
+    Exons of each transcript are expected to be sorted and not overlapping,
+    as in refFlat and BED12 files.
+    '''
+
+    columns = ('gene', 'isoform', 'chrom', 'strand', 'tx_start', 'tx_end',
+               'cds_start', 'cds_end', 'exon_starts', 'exon_ends',
+               'exon_offsets')
+
+    def __init__(self, columns):
+        for key in AnnotationTable.columns:
+            setattr(self, key, columns[key])
+
+    def __len__(self):
+        return len(self.tx_start)
+
+    @classmethod
+    def from_infos(cls, infos):
+        '''
+        Build AnnotationTable from Info records.
+        '''
+        return _table_from_rows([_ref_row(info) for info in infos], 'ref')
+
+    @property
+    def exon_transcripts(self):
+        '''
+        Return transcript index of every exon.
+        '''
+        return np.repeat(np.arange(len(self)), np.diff(self.exon_offsets))
+
+    def exon_regions(self):
+        '''
+        Return (transcript index, starts, ends) of exons.
+        '''
+        return self.exon_transcripts, self.exon_starts, self.exon_ends
+
+    def intron_regions(self):
+        '''
+        Return (transcript index, starts, ends) of introns.
+        '''
+        tid = self.exon_transcripts
+        mask = tid[1:] == tid[:-1]
+        return tid[1:][mask], self.exon_ends[:-1][mask], \
+            self.exon_starts[1:][mask]
+
+    def utr5_regions(self):
+        '''
+        Return (transcript index, starts, ends) of 5UTR regions, the same as
+        Info.utr5_regions of every transcript.
+        '''
+        plus = self.strand == '+'
+        return self.__split(np.where(plus, 'left', 'right'))
+
+    def utr3_regions(self):
+        '''
+        Return (transcript index, starts, ends) of 3UTR regions.
+        '''
+        plus = self.strand == '+'
+        return self.__split(np.where(plus, 'right', 'left'))
+
+    def cds_regions(self):
+        '''
+        Return (transcript index, starts, ends) of CDS regions.
+        '''
+        return self.__split(np.full(len(self), 'middle'))
+
+    def features(self, names=FEATURES, dis=0, direction='both'):
+        '''
+        Return {name: (transcript index, starts, ends)} for feature names in
+        FEATURES, all computed in one pass. TSS, TES and gene are extended by
+        dis to direction ('both', 'upstream' or 'downstream').
+        '''
+        plus = self.strand == '+'
+        up = 0 if direction == 'downstream' else dis
+        down = 0 if direction == 'upstream' else dis
+        left, right = np.where(plus, up, down), np.where(plus, down, up)
+        tid = np.arange(len(self))
+        regions = {}
+        for name in names:
+            if name == 'TSS':
+                site = np.where(plus, self.tx_start, self.tx_end)
+            elif name == 'TES':
+                site = np.where(plus, self.tx_end, self.tx_start)
+            if name in ('TSS', 'TES'):
+                regions[name] = (tid, np.maximum(site - left, 0),
+                                 site + right)
+            elif name == 'gene':
+                regions[name] = (tid, np.maximum(self.tx_start - left, 0),
+                                 self.tx_end + right)
+            elif name in FEATURE_REGIONS:
+                regions[name] = getattr(self, FEATURE_REGIONS[name])()
+            else:
+                sys.exit('Error: unknown feature %s!' % name)
+        return regions
+
+    def __split(self, flag):
+        # vectorized Interval.split of exons at cds_start and cds_end
+        tid, exon_starts, exon_ends = self.__merged_exons()
+        x, y = self.cds_start[tid], self.cds_end[tid]
+        flag = flag[tid]
+        left, right = flag == 'left', flag == 'right'
+        starts = np.where(left, exon_starts,
+                          np.maximum(exon_starts, np.where(right, y, x)))
+        ends = np.where(right, exon_ends, np.minimum(exon_ends, y))
+        ends = np.where(left, np.minimum(exon_ends, x), ends)
+        mask = (self.cds_start != self.cds_end)[tid] & (starts < ends)
+        return tid[mask], starts[mask], ends[mask]
+
+    def __merged_exons(self):
+        # exons of every transcript merged as Interval does: blocks
+        # overlapping the previous ones are joined, touching ones are kept
+        tid = self.exon_transcripts
+        order = np.lexsort((self.exon_starts, tid))
+        tid = tid[order]
+        starts, ends = self.exon_starts[order], self.exon_ends[order]
+        if not len(tid):
+            return tid, starts, ends
+        # running max of exon ends within each transcript
+        reach = np.maximum.accumulate((tid << 32) | ends) & 0xFFFFFFFF
+        new = np.ones(len(tid), dtype=bool)
+        new[1:] = (tid[1:] != tid[:-1]) | (starts[1:] >= reach[:-1])
+        first = np.flatnonzero(new)
+        return tid[first], starts[first], np.maximum.reduceat(ends, first)
+
+
+class TranscriptMapper(object):
+    '''
+    Map positions between genome and transcript (or CDS) coordinates.
+
+    Usage: mapper = TranscriptMapper(table)
+           (table: AnnotationTable, or a list of Info)
+    Notes: all coordinates are 0-based. Transcript and CDS offsets count
+           from the 5' end, i.e. from tx_end - 1 and cds_end - 1 on '-'
+           strand. Positions are mapped in batches: tid (transcript indices)
+           and positions are NumPy arrays (or scalars) broadcast together,
+           and unmapped positions (intronic, outside the transcript, or
+           non-coding for CDS) are -1.
+
+    For example: exons [[100, 200], [300, 400]] on '-' strand
+                 mapper.genome_to_transcript(0, [399, 300, 250]) -> [0, 99, -1]
+                 mapper.transcript_to_genome(0, [100, 200]) -> [199, -1]
+
+    Attributes: table, exon_cum (exonic length before each exon, from the
+                left), mRNA_length, cds_offset (transcript offset of the
+                first CDS base, -1 if non-coding), cds_length
+
+    Functions: mapper.genome_to_transcript(tid, pos) -> offsets
+               mapper.transcript_to_genome(tid, offset) -> positions
+               mapper.genome_to_cds(tid, pos) -> offsets
+               mapper.cds_to_genome(tid, offset) -> positions
+    '''
+
+    def __init__(self, table):
+        if not isinstance(table, AnnotationTable):
+            table = AnnotationTable.from_infos(table)
+        self.table = table
+        lengths = table.exon_ends - table.exon_starts
+        cum = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=cum[1:])
+        offsets = np.asarray(table.exon_offsets)
+        tid = table.exon_transcripts
+        # the search keys below need sorted, non-overlapping exons
+        same = tid[1:] == tid[:-1]
+        assert not (same & (table.exon_starts[1:] <
+                            table.exon_ends[:-1])).any(), \
+            'Exons of every transcript should be sorted and not overlapping'
+        self.exon_cum = cum[:-1] - cum[offsets[:-1]][tid]
+        self.mRNA_length = cum[offsets[1:]] - cum[offsets[:-1]]
+        self._minus = np.asarray(table.strand) == '-'
+        # search keys: transcript index in high bits, coordinate in low bits
+        self._start_keys = (tid << 32) | table.exon_starts
+        self._cum_keys = (tid << 32) | self.exon_cum
+        # exonic bounds of CDS
+        cds_tid, cds_starts, cds_ends = table.cds_regions()
+        coding_tid, first_piece = np.unique(cds_tid, return_index=True)
+        last_piece = np.searchsorted(cds_tid, coding_tid, side='right') - 1
+        coding = np.zeros(len(table), dtype=bool)
+        coding[coding_tid] = True
+        left = np.zeros(len(table), dtype=np.int64)
+        right = np.zeros(len(table), dtype=np.int64)
+        left[coding_tid] = cds_starts[first_piece]
+        right[coding_tid] = cds_ends[last_piece] - 1
+        all_tid = np.arange(len(table))
+        left = self.genome_to_transcript(all_tid, left)
+        right = self.genome_to_transcript(all_tid, right)
+        first = np.where(self._minus, right, left)
+        self.cds_offset = np.where(coding, first, -1)
+        self.cds_length = np.where(coding, np.abs(right - left) + 1, 0)
+
+    def genome_to_transcript(self, tid, pos):
+        '''
+        Usage: mapper.genome_to_transcript(tid, pos)
+        map genomic positions onto transcript offsets.
+        '''
+        tid, pos = np.broadcast_arrays(np.asarray(tid, dtype=np.int64),
+                                       np.asarray(pos, dtype=np.int64))
+        if not len(self.table):  # nothing can be mapped
+            return np.full(tid.shape, -1, dtype=np.int64)
+        offsets = np.asarray(self.table.exon_offsets)
+        k = np.searchsorted(self._start_keys, (tid << 32) | pos,
+                            side='right') - 1
+        k = np.maximum(k, 0)
+        ok = (pos >= 0) & (k >= offsets[tid]) & (k < offsets[tid + 1])
+        ok &= pos < self.table.exon_ends[k]
+        offset = self.exon_cum[k] + pos - self.table.exon_starts[k]
+        offset = np.where(self._minus[tid],
+                          self.mRNA_length[tid] - 1 - offset, offset)
+        return np.where(ok, offset, -1)
+
+    def transcript_to_genome(self, tid, offset):
+        '''
+        Usage: mapper.transcript_to_genome(tid, offset)
+        map transcript offsets onto genomic positions.
+        '''
+        tid, offset = np.broadcast_arrays(np.asarray(tid, dtype=np.int64),
+                                          np.asarray(offset, dtype=np.int64))
+        if not len(self.table):  # nothing can be mapped
+            return np.full(tid.shape, -1, dtype=np.int64)
+        length = self.mRNA_length[tid]
+        ok = (offset >= 0) & (offset < length)
+        left = np.where(self._minus[tid], length - 1 - offset, offset)
+        left = np.where(ok, left, 0)
+        k = np.searchsorted(self._cum_keys, (tid << 32) | left,
+                            side='right') - 1
+        k = np.maximum(k, 0)
+        pos = self.table.exon_starts[k] + left - self.exon_cum[k]
+        return np.where(ok, pos, -1)
+
+    def genome_to_cds(self, tid, pos):
+        '''
+        Usage: mapper.genome_to_cds(tid, pos)
+        map genomic positions onto CDS offsets (-1 outside CDS).
+        '''
+        tid, pos = np.broadcast_arrays(np.asarray(tid, dtype=np.int64),
+                                       np.asarray(pos, dtype=np.int64))
+        if not len(self.table):  # nothing can be mapped
+            return np.full(tid.shape, -1, dtype=np.int64)
+        offset = self.genome_to_transcript(tid, pos) - self.cds_offset[tid]
+        ok = (self.cds_offset[tid] >= 0) & (offset >= 0) & \
+            (offset < self.cds_length[tid])
+        return np.where(ok & (pos >= 0), offset, -1)
+
+    def cds_to_genome(self, tid, offset):
+        '''
+        Usage: mapper.cds_to_genome(tid, offset)
+        map CDS offsets onto genomic positions.
+        '''
+        tid, offset = np.broadcast_arrays(np.asarray(tid, dtype=np.int64),
+                                          np.asarray(offset, dtype=np.int64))
+        if not len(self.table):  # nothing can be mapped
+            return np.full(tid.shape, -1, dtype=np.int64)
+        ok = (offset >= 0) & (offset < self.cds_length[tid])
+        pos = self.transcript_to_genome(tid, np.where(ok, offset, 0) +
+                                        self.cds_offset[tid])
+        return np.where(ok, pos, -1)
+
+
+def load_annotation(fname, ftype='ref', cache=False, checksum=False):
+    '''
+    Load a whole refFlat (ftype='ref'), BED12 (ftype='bed'), GTF (ftype='gtf')
+    or GFF3 (ftype='gff') file into an AnnotationTable.
+    If cache is True, parsed columns are saved into `fname.ftype.cache`
+    next to the annotation and later loads open them memory-mapped. The
+    cache is rebuilt once the size or mtime of the annotation changes, or
+    its MD5 too if checksum is True.
+    '''
+    if cache:
+        table = _read_cache(fname, ftype, checksum)
+        if table is None:
+            meta = _cache_meta(fname, ftype, checksum)
+            table = load_annotation(fname, ftype)
+            _write_cache(fname, meta, table)
+        return table
+    if ftype in ('gtf', 'gff'):
+        rows = [_ref_row(info) for info in parse_gtf(fname, ftype)]
+        ftype = 'ref'
+    else:
+        with _open_text(fname) as f:
+            rows = [line.split() for line in _read_lines(f) if line.strip()]
+    return _table_from_rows(rows, ftype)
+
+
+def _table_from_rows(rows, ftype):
+    if ftype == 'ref':
+        assert all(len(row) == 11 for row in rows), \
+            'REF format should have 11 columns'
+        fields = list(zip(*rows)) if rows else [()] * 11
+        gene, isoform, chrom, strand = fields[:4]
+        tx_start, tx_end = _int_column(fields[4]), _int_column(fields[5])
+        exon_starts, counts = _int_lists(fields[9])
+        exon_ends, _ = _int_lists(fields[10])
+    elif ftype == 'bed':
+        assert all(len(row) == 12 for row in rows), \
+            'BED format should have 12 columns'
+        fields = list(zip(*rows)) if rows else [()] * 12
+        chrom, gene, strand = fields[0], fields[3], fields[5]
+        isoform = gene
+        tx_start, tx_end = _int_column(fields[1]), _int_column(fields[2])
+        offsets, counts = _int_lists(fields[11])
+        sizes, _ = _int_lists(fields[10])
+        exon_starts = np.repeat(tx_start, counts) + offsets
+        exon_ends = exon_starts + sizes
+    else:
+        sys.exit('Wrong format!')
+    exon_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(counts, out=exon_offsets[1:])
+    return AnnotationTable({'gene': np.array(gene, dtype=str),
+                            'isoform': np.array(isoform, dtype=str),
+                            'chrom': np.array(chrom, dtype=str),
+                            'strand': np.array(strand, dtype=str),
+                            'tx_start': tx_start, 'tx_end': tx_end,
+                            'cds_start': _int_column(fields[6]),
+                            'cds_end': _int_column(fields[7]),
+                            'exon_starts': exon_starts,
+                            'exon_ends': exon_ends,
+                            'exon_offsets': exon_offsets})
+
+
+ANNOTATION_CACHE_VERSION = 1
+
+
+def _cache_meta(fname, ftype, checksum):
+    from .helper import md5sum
+    stat = os.stat(fname)
+    meta = {'version': ANNOTATION_CACHE_VERSION, 'type': ftype,
+            'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    if checksum:
+        meta['md5'] = md5sum(fname)
+    return meta
+
+
+def _read_cache(fname, ftype, checksum, cls=None, suffix='cache'):
+    '''
+    Open cached columns of an annotation (AnnotationTable, or cls), or return
+    None if stale.
+    '''
+    import msgpack
+    from .helper import md5sum
+    cls = AnnotationTable if cls is None else cls
+    cache_dir = '%s.%s.%s' % (fname, ftype, suffix)
+    meta_f = os.path.join(cache_dir, 'meta.msg')
+    if not os.path.isfile(meta_f):
+        return None
+    # a partial or corrupt cache is rebuilt
+    try:
+        with open(meta_f, 'rb') as f:
+            meta = msgpack.unpackb(f.read(), raw=False)
+        current = _cache_meta(fname, ftype, checksum=False)
+        if any(meta.get(key) != value for key, value in current.items()):
+            return None
+        if checksum:
+            md5 = md5sum(fname)
+            if 'md5' not in meta:  # first check of a fresh cache, record it
+                meta['md5'] = md5
+                with open(meta_f, 'wb') as f:
+                    f.write(msgpack.packb(meta, use_bin_type=True))
+            elif meta['md5'] != md5:
+                return None
+        columns = {key: np.load(os.path.join(cache_dir, key + '.npy'),
+                                mmap_mode='r')
+                   for key in cls.columns}
+    except (OSError, ValueError, AttributeError):
+        return None
+    return cls(columns)
+
+
+def _write_cache(fname, meta, table, suffix='cache'):
+    '''
+    Save columns of an annotation next to it, or warn if it is not possible.
+    '''
+    import msgpack
+    cache_dir = '%s.%s.%s' % (fname, meta['type'], suffix)
+    tmp_dir = None
+    try:
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(
+            fname)))
+        for key in type(table).columns:
+            np.save(os.path.join(tmp_dir, key + '.npy'), getattr(table, key))
+        with open(os.path.join(tmp_dir, 'meta.msg'), 'wb') as f:
+            f.write(msgpack.packb(meta, use_bin_type=True))
+        # mkdtemp() is private (0700), share the cache as umask allows
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_dir, 0o777 & ~umask)
+        if os.path.isdir(cache_dir):
+            shutil.rmtree(cache_dir)
+        os.rename(tmp_dir, cache_dir)
+    except OSError as e:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        warnings.warn('Cannot cache %s: %s' % (fname, e))
+
+
+class AnnotationIndex(object):
+    '''
+    Byte offsets of the records of a refFlat or BED12 file, see
+    load_annotation_index().
+
+    Attributes: offset, chrom, tx_start, tx_end (one per record),
+                gene_keys, gene_ids (sorted gene names and their record
+                indices), isoform_keys, isoform_ids (the same for isoforms)
+    '''
+
+    columns = ('offset', 'chrom', 'tx_start', 'tx_end', 'gene_keys',
+               'gene_ids', 'isoform_keys', 'isoform_ids')
+
+    def __init__(self, columns):
+        for key in AnnotationIndex.columns:
+            setattr(self, key, columns[key])
+        self._regions = {}
+
+    def __len__(self):
+        return len(self.offset)
+
+    def gene_records(self, gene):
+        '''
+        Return record indices of a gene, in file order.
+        '''
+        return self.__lookup(self.gene_keys, self.gene_ids, gene)
+
+    def isoform_records(self, isoform):
+        '''
+        Return record indices of an isoform, in file order.
+        '''
+        return self.__lookup(self.isoform_keys, self.isoform_ids, isoform)
+
+    def region_records(self, chrom, sta, end):
+        '''
+        Return record indices of transcripts overlapping [sta, end), in file
+        order.
+        '''
+        if chrom not in self._regions:  # built once per chromosome
+            rid = np.flatnonzero(self.chrom == chrom)
+            self._regions[chrom] = IntervalIndex(
+                [[s, e, i] for s, e, i in zip(self.tx_start[rid].tolist(),
+                                              self.tx_end[rid].tolist(),
+                                              rid.tolist())])
+        return sorted(i[2] for i in self._regions[chrom].find(sta, end))
+
+    def __lookup(self, keys, ids, name):
+        sta = np.searchsorted(keys, name, side='left')
+        end = np.searchsorted(keys, name, side='right')
+        return sorted(ids[sta:end].tolist())
+
+
+def load_annotation_index(fname, ftype='ref', cache=True):
+    '''
+    Index records of an uncompressed refFlat (ftype='ref') or BED12
+    (ftype='bed') file by gene, isoform and genomic region. The index is
+    stored in fname.ftype.index unless cache is False.
+    '''
+    assert ftype in ('ref', 'bed'), 'Only REF and BED files can be indexed'
+    assert not _is_gzip(fname), 'Compressed files can not be indexed'
+    if cache:
+        index = _read_cache(fname, ftype, False, cls=AnnotationIndex,
+                            suffix='index')
+        if index is None:
+            meta = _cache_meta(fname, ftype, checksum=False)
+            index = load_annotation_index(fname, ftype, cache=False)
+            _write_cache(fname, meta, index, suffix='index')
+        return index
+    offsets, rows = [], []
+    pos = 0
+    with open(fname, 'rb') as f:
+        for line in f:
+            if line.strip():
+                offsets.append(pos)
+                rows.append(line.split(None, 6)[:6])
+            pos += len(line)
+    fields = list(zip(*rows)) if rows else [()] * 6
+    if ftype == 'ref':
+        gene, isoform, chrom = fields[0], fields[1], fields[2]
+        tx_start, tx_end = fields[4], fields[5]
+    else:
+        chrom, tx_start, tx_end = fields[0], fields[1], fields[2]
+        gene = isoform = fields[3]
+    columns = {'offset': np.array(offsets, dtype=np.int64),
+               'chrom': np.array(chrom, dtype=bytes).astype(str),
+               'tx_start': _int_column(tx_start),
+               'tx_end': _int_column(tx_end)}
+    for key, names in (('gene', gene), ('isoform', isoform)):
+        names = np.array(names, dtype=bytes).astype(str)
+        order = np.argsort(names, kind='stable')
+        columns[key + '_keys'] = names[order]
+        columns[key + '_ids'] = order.astype(np.int64)
+    return AnnotationIndex(columns)
+
+
+def _ref_row(info):
+    return [info.gene, info.isoform, info.chrom, info.strand,
+            str(info.tx_start), str(info.tx_end), str(info.cds_start),
+            str(info.cds_end), str(info.exon_num),
+            ''.join('%d,' % x for x in info.exon_starts),
+            ''.join('%d,' % x for x in info.exon_ends)]
+
+
+def _int_column(field):
+    return np.fromiter(map(int, field), np.int64, len(field))
+
+
+def _int_lists(field):
+    '''
+    Flatten comma separated integer lists into one array plus list sizes.
+    '''
+    field = [x.rstrip(',') for x in field]
+    counts = np.array([x.count(',') + 1 for x in field], dtype=np.int64)
+    values = ','.join(field).split(',') if field else []
+    return _int_column(values), counts
+
+
+GTF_ATTR = re.compile(r'(\S+) "([^"]*)"')
+GTF_CDS_FEATURES = ('CDS', 'start_codon', 'stop_codon')
+
+
+def _gtf_records(lines, ftype='gtf'):
+    '''
+    Group exon and CDS features of GTF/GFF3 lines into refFlat-like Info.
+    Transcripts are kept in memory only until their gene ends, so features
+    of a gene should be contiguous.
+    '''
+    group = None
+    genes = set()  # GTF: gene IDs already seen
+    flushed = set()  # transcript IDs already converted
+    transcripts = {}
+    names = {}  # GFF3: gene ID -> gene name
+    parent_of = {}  # GFF3: transcript ID -> gene ID
+    for line in lines:
+        if line.startswith('#') or not line.strip():
+            continue
+        fields = line.rstrip('\n').split('\t')
+        assert len(fields) == 9, 'GTF/GFF3 format should have 9 columns'
+        chrom, _, feature, sta, end, _, strand, _, attr = fields
+        if ftype == 'gtf':
+            attr = dict(GTF_ATTR.findall(attr))
+            gene_id = attr.get('gene_id')
+            if gene_id != group:
+                if gene_id in genes:
+                    sys.exit('Error: lines of gene %s are not contiguous, '
+                             'please sort the file by gene!' % gene_id)
+                genes.add(gene_id)
+                flushed.update(transcripts)
+                for info in _flush_transcripts(transcripts, names,
+                                               parent_of):
+                    yield info
+                group = gene_id
+            if 'transcript_id' not in attr:
+                continue
+            tids = [attr['transcript_id']]
+            gene = attr.get('gene_name', gene_id)
+        else:
+            attr = dict(item.split('=', 1) for item in attr.split(';')
+                        if '=' in item)
+            tid = unquote(attr.get('ID', ''))
+            parents = [unquote(x) for x in attr['Parent'].split(',')] \
+                if 'Parent' in attr else []
+            if not parents:  # a new gene (or an orphan transcript)
+                flushed.update(transcripts, parent_of)
+                for info in _flush_transcripts(transcripts, names,
+                                               parent_of):
+                    yield info
+                names[tid] = unquote(attr.get('Name', tid))
+                continue
+            if feature not in ('exon',) + GTF_CDS_FEATURES:
+                parent_of[tid] = parents[0]  # a transcript
+                continue
+            tids = parents
+            gene = None
+        for tid in tids:
+            if tid in flushed:
+                sys.exit('Error: features of transcript %s are not '
+                         'contiguous, please sort the file by gene!' % tid)
+            if tid not in transcripts:
+                transcripts[tid] = {'chrom': chrom, 'strand': strand,
+                                    'gene': gene, 'exon': [], 'cds': []}
+            if feature == 'exon':
+                transcripts[tid]['exon'].append((int(sta) - 1, int(end)))
+            elif feature in GTF_CDS_FEATURES:
+                transcripts[tid]['cds'].append((int(sta) - 1, int(end)))
+    for info in _flush_transcripts(transcripts, names, parent_of):
+        yield info
+
+
+def _flush_transcripts(transcripts, names, parent_of):
+    '''
+    Convert buffered transcripts into Info and clear the buffers.
+    '''
+    for tid, rec in transcripts.items():
+        if not rec['exon']:
+            continue
+        exons = sorted(rec['exon'])
+        gene = rec['gene']
+        if gene is None:  # GFF3
+            gene_id = parent_of.get(tid, tid)
+            gene = names.get(gene_id, gene_id)
+        tx_start, tx_end = exons[0][0], max(e for _, e in exons)
+        if rec['cds']:
+            cds_start = min(s for s, _ in rec['cds'])
+            cds_end = max(e for _, e in rec['cds'])
+        else:  # non-coding, as in refFlat
+            cds_start = cds_end = tx_end
+        yield Info([gene, tid, rec['chrom'], rec['strand'], str(tx_start),
+                    str(tx_end), str(cds_start), str(cds_end),
+                    str(len(exons)),
+                    ''.join('%d,' % s for s, _ in exons),
+                    ''.join('%d,' % e for _, e in exons)])
+    transcripts.clear()
+    names.clear()
+    parent_of.clear()
+
+
+def parse_gtf(fname, ftype='gtf', n_jobs=1):
+    '''
+    Parse a whole GTF (ftype='gtf') or GFF3 (ftype='gff') file into a list of
+    Info. With n_jobs other than 1, the file is split by chromosome and the
+    chromosomes are parsed in parallel (compressed files are always parsed
+    serially, since they can not be split by byte ranges).
+    '''
+    if n_jobs == 1 or _is_gzip(fname):
+        anno = Annotation(fname, ftype=ftype)
+        infos = list(anno)
+        anno.close()
+        return infos
+    results = Parallel(n_jobs=n_jobs)(delayed(_parse_gtf_range)(fname, ftype,
+                                                                sta, end)
+                                      for sta, end in _chrom_ranges(fname))
+    return [info for infos in results for info in infos]
+
+
+def _chrom_ranges(fname):
+    '''
+    Return byte ranges of consecutive lines on the same chromosome.
+    '''
+    ranges = []
+    chrom = None
+    offset = sta = 0
+    with open(fname, 'rb') as f:
+        for line in f:
+            if not line.startswith(b'#'):
+                current = line.split(b'\t', 1)[0]
+                if current != chrom:
+                    if chrom is not None:
+                        ranges.append((sta, offset))
+                    chrom, sta = current, offset
+            offset += len(line)
+    if chrom is not None:
+        ranges.append((sta, offset))
+    return ranges
+
+
+def _parse_gtf_range(fname, ftype, sta, end):
+    with open(fname, 'rb') as f:
+        f.seek(sta)
+        lines = f.read(end - sta).decode().splitlines()
+    return list(_gtf_records(lines, ftype))
+
+
 STAR_JUNC_STRAND = {'0': '*', '1': '+', '2': '-'}
 STAR_JUNC_MOTIF = {'0': 'NA', '1': 'GT/AG', '2': 'CT/AC', '3': 'GC/AG',
                    '4': 'CT/GC', '5': 'AT/AC', '6': 'GT/AT'}
@@ -492,32 +1241,213 @@ class STAR_Junc(object):
                     self.read)
 
 
+STAR_STRAND_CODES = np.array(['*', '+', '-'])
+STAR_MOTIF_CODES = np.array(['NA', 'GT/AG', 'CT/AC', 'GC/AG', 'CT/GC',
+                             'AT/AC', 'GT/AT'])
+
+
+class StarJuncTable(object):
+    '''
+    Whole STAR SJ.out.tab in columns, see load_star_junc().
+
+    Attributes: chrom (str array), start, end (int64 arrays, 0-based),
+                strand_code, motif_code (int8 arrays, indices of
+                STAR_STRAND_CODES and STAR_MOTIF_CODES), is_annotated (bool
+                array), uniq_read, multi_read, overhang (int32 arrays)
+    '''
+
+    columns = ('chrom', 'start', 'end', 'strand_code', 'motif_code',
+               'is_annotated', 'uniq_read', 'multi_read', 'overhang')
+
+    def __init__(self, columns):
+        for key in StarJuncTable.columns:
+            setattr(self, key, columns[key])
+
+    def __len__(self):
+        return len(self.start)
+
+    @property
+    def strand(self):
+        return STAR_STRAND_CODES[self.strand_code]
+
+    @property
+    def motif(self):
+        return STAR_MOTIF_CODES[self.motif_code]
+
+    @property
+    def read(self):
+        return self.uniq_read + self.multi_read
+
+    def reads(self, read_type=None):
+        '''
+        Return read counts as in STAR_Junc.info().
+        '''
+        if read_type == 'unique':
+            return self.uniq_read
+        elif read_type == 'multiple':
+            return self.multi_read
+        else:
+            return self.read
+
+
+def load_star_junc(fname):
+    '''
+    Load STAR SJ.out.tab (optionally gzipped) into a StarJuncTable, without
+    creating objects per junction: all the columns are parsed from the byte
+    buffer in one np.loadtxt pass with a structured dtype.
+    '''
+    with _open_text(fname) as f:
+        data = f.read().encode().rstrip(b'\n')
+    # the longest line (minus 8 tabs and 8 digits) bounds the chrom width
+    ends = np.flatnonzero(np.frombuffer(data + b'\n', dtype=np.uint8) == 10)
+    size = max(int(np.diff(ends, prepend=-1).max()) - 16, 1)
+    dtype = np.dtype([('chrom', 'S%d' % size), ('values', np.int64, 8)])
+    if data:
+        table = np.loadtxt(io.BytesIO(data), dtype=dtype, delimiter='\t',
+                           ndmin=1)
+    else:
+        table = np.empty(0, dtype=dtype)
+    chrom = table['chrom']
+    chrom = chrom.astype('U%d' % max(np.char.str_len(chrom).max(initial=1),
+                                     1))
+    values = table['values']
+    columns = {'chrom': chrom,
+               'start': values[:, 0] - 1,
+               'end': values[:, 1].copy()}
+    for key, i, dtype in (('strand_code', 2, np.int8),
+                          ('motif_code', 3, np.int8),
+                          ('is_annotated', 4, np.bool_),
+                          ('uniq_read', 5, np.int32),
+                          ('multi_read', 6, np.int32),
+                          ('overhang', 7, np.int32)):
+        columns[key] = values[:, i].astype(dtype)
+    return StarJuncTable(columns)
+
+
+def junc_matrix(fnames, read_type=None, n_jobs=1):
+    '''
+    Merge STAR SJ.out.tab files into a junction-by-sample count matrix.
+
+    Return (chrom, start, end, strand, matrix): junctions sorted by chrom,
+    start, end and strand, and an int32 matrix with a column per file (0 for
+    junctions missing in a sample).
+    '''
+    if n_jobs == 1:
+        tables = [load_star_junc(fname) for fname in fnames]
+    else:
+        tables = Parallel(n_jobs=n_jobs)(delayed(load_star_junc)(fname)
+                                         for fname in fnames)
+    chroms, chrom_code = np.unique(_concat(tables, 'chrom', str),
+                                   return_inverse=True)
+    start = _concat(tables, 'start', np.int64)
+    end = _concat(tables, 'end', np.int64)
+    strand = _concat(tables, 'strand_code', np.int8)
+    order = np.lexsort((strand, end, start, chrom_code))
+    keys = (chrom_code[order], start[order], end[order], strand[order])
+    new = np.ones(len(order), dtype=bool)
+    new[1:] = np.any([k[1:] != k[:-1] for k in keys], axis=0)
+    index = np.empty(len(order), dtype=np.int64)
+    index[order] = np.cumsum(new) - 1
+    sample = np.repeat(np.arange(len(tables)), [len(t) for t in tables])
+    reads = np.concatenate([t.reads(read_type) for t in tables]
+                           + [np.array([], np.int32)])
+    matrix = np.bincount(index * len(tables) + sample, weights=reads,
+                         minlength=new.sum() * len(tables))
+    matrix = matrix.astype(np.int32).reshape(-1, len(tables))
+    first = order[new]
+    return (chroms[chrom_code[first]], start[first], end[first],
+            STAR_STRAND_CODES[strand[first]], matrix)
+
+
+def _concat(tables, column, dtype):
+    return np.concatenate([getattr(t, column) for t in tables]
+                          + [np.array([], dtype)])
+
+
 @implements_iterator
 class Annotation(object):
 
     def __init__(self, fname, ftype='ref'):
-        self._fh = open(fname, 'r')
+        '''
+        ftype: 'ref' (refFlat), 'bed' (BED12), 'gtf' or 'gff' (GFF3)
+        GTF/GFF3 files are grouped into transcripts on the fly, and should
+        keep the features of a gene together as released by GENCODE or
+        Ensembl.
+        Uncompressed REF/BED files also support random access through
+        fetch_gene(), fetch_isoform() and fetch().
+        '''
+        self._fname = fname
+        self._fh = _open_text(fname)
+        self._lines = _read_lines(self._fh)
         self._type = ftype
+        self._index = None
+        self._raw = None
+        if ftype in ('gtf', 'gff'):
+            self._records = _gtf_records(self._lines, ftype)
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        info = self._fh.readline()
-        if info:
-            return Info(info.rstrip().split(), ftype=self._type)
+        if self._type in ('gtf', 'gff'):
+            return next(self._records)
+        info = next(self._lines, None)
+        if info is not None:
+            return _annotation_record(info, self._type)
         else:
             raise StopIteration()
 
+    def fetch_gene(self, gene):
+        '''
+        Return Info of all isoforms of a gene through the annotation index.
+        '''
+        return self.__fetch(self.index.gene_records(gene))
+
+    def fetch_isoform(self, isoform):
+        '''
+        Return Info of an isoform (or None) through the annotation index.
+        '''
+        infos = self.__fetch(self.index.isoform_records(isoform))
+        return infos[0] if infos else None
+
+    def fetch(self, chrom, sta, end):
+        '''
+        Return Info of transcripts overlapping [sta, end) on chrom through the
+        annotation index.
+        '''
+        return self.__fetch(self.index.region_records(chrom, sta, end))
+
+    @property
+    def index(self):
+        '''
+        Return AnnotationIndex, built (and cached) on first use.
+        '''
+        if self._index is None:
+            self._index = load_annotation_index(self._fname, self._type)
+        return self._index
+
+    def __fetch(self, records):
+        if self._raw is None:
+            self._raw = open(self._fname, 'rb')
+        infos = []
+        for rid in records:
+            self._raw.seek(int(self.index.offset[rid]))
+            info = self._raw.readline().decode().split()
+            infos.append(Info(info, ftype=self._type))
+        return infos
+
     def close(self):
         self._fh.close()
+        if self._raw is not None:
+            self._raw.close()
 
 
 @implements_iterator
 class Junc(object):
 
     def __init__(self, fname, aligner=None, info_flag=True, read_type=None):
-        self._fh = open(fname, 'r')
+        self._fh = _open_text(fname)
+        self._lines = _read_lines(self._fh)
         self._aligner = aligner
         self._info_flag = info_flag
         self._read_type = read_type
@@ -526,23 +1456,10 @@ class Junc(object):
         return self
 
     def __next__(self):
-        info = self._fh.readline()
-        if info:
-            if self._aligner == 'STAR':
-                junc_info = STAR_Junc(info.rstrip().split())
-                if self._info_flag:
-                    return junc_info.info(read_type=self._read_type)
-                else:
-                    return junc_info
-            else:
-                junc_info = Info(info.rstrip().split(), ftype='bed')
-                if junc_info.exon_num != 2:
-                    sys.exit('Error: exon number is not 2!')
-                junc_read = int(junc_info.name.split('/')[1])
-                junc_start = junc_info.intron_starts[0]
-                junc_end = junc_info.intron_ends[0]
-                return (junc_info.chrom, junc_start, junc_end,
-                        junc_info.strand, junc_read)
+        info = next(self._lines, None)
+        if info is not None:
+            return _junc_record(info, self._aligner, self._info_flag,
+                                self._read_type)
         else:
             raise StopIteration()
 
@@ -550,6 +1467,110 @@ class Junc(object):
         self._fh.close()
 
 
+def _annotation_record(line, ftype):
+    return Info(line.rstrip().split(), ftype=ftype)
+
+
+def _junc_record(line, aligner, info_flag, read_type):
+    if aligner == 'STAR':
+        junc_info = STAR_Junc(line.rstrip().split())
+        if info_flag:
+            return junc_info.info(read_type=read_type)
+        else:
+            return junc_info
+    else:
+        junc_info = Info(line.rstrip().split(), ftype='bed')
+        if junc_info.exon_num != 2:
+            sys.exit('Error: exon number is not 2!')
+        junc_read = int(junc_info.name.split('/')[1])
+        junc_start = junc_info.intron_starts[0]
+        junc_end = junc_info.intron_ends[0]
+        return (junc_info.chrom, junc_start, junc_end, junc_info.strand,
+                junc_read)
+
+
+CHUNK_SIZE = 1 << 25  # 32 MiB
+
+
+def read_annotation(fname, ftype='ref', n_jobs=1, ordered=True,
+                    chunk_size=CHUNK_SIZE):
+    '''
+    Parse a refFlat (ftype='ref') or BED12 (ftype='bed') file in byte chunks
+    split at line boundaries, with n_jobs processes. Yield Info in file
+    order, or as soon as chunks are parsed if ordered is False.
+    '''
+    assert ftype in ('ref', 'bed'), 'Only REF and BED files can be chunked'
+    return _read_chunks(fname, _annotation_record, (ftype,), n_jobs,
+                        ordered, chunk_size)
+
+
+def read_junc(fname, aligner=None, info_flag=True, read_type=None, n_jobs=1,
+              ordered=True, chunk_size=CHUNK_SIZE):
+    '''
+    Parallel version of Junc, see read_annotation().
+    '''
+    return _read_chunks(fname, _junc_record, (aligner, info_flag, read_type),
+                        n_jobs, ordered, chunk_size)
+
+
+def read_junc_files(fnames, aligner=None, info_flag=True, read_type=None,
+                    n_jobs=1, ordered=True):
+    '''
+    Parse many junction files, one file per task. Yield (fname, records) in
+    the order of fnames, or as soon as files are parsed if ordered is False.
+    '''
+    args = (aligner, info_flag, read_type)
+    return_as = 'generator' if ordered else 'generator_unordered'
+    return Parallel(n_jobs=n_jobs, return_as=return_as)(
+        delayed(_parse_file)(fname, _junc_record, args) for fname in fnames)
+
+
+def _read_chunks(fname, parse, args, n_jobs, ordered, chunk_size):
+    return_as = 'generator' if ordered else 'generator_unordered'
+    if _is_gzip(fname):  # compressed files can not be split by byte ranges
+        ranges = [(0, None)]
+    else:
+        ranges = _line_ranges(fname, chunk_size)
+    results = Parallel(n_jobs=n_jobs, return_as=return_as)(
+        delayed(_parse_range)(fname, parse, args, sta, end)
+        for sta, end in ranges)
+    for records in results:
+        for record in records:
+            yield record
+
+
+def _line_ranges(fname, chunk_size):
+    '''
+    Split a file into byte ranges of about chunk_size at line boundaries.
+    '''
+    size = os.path.getsize(fname)
+    bounds = [0]
+    with open(fname, 'rb') as f:
+        while bounds[-1] + chunk_size < size:
+            f.seek(bounds[-1] + chunk_size - 1)
+            f.readline()  # move to the start of the next line
+            if f.tell() >= size:
+                break
+            bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _parse_range(fname, parse, args, sta, end):
+    if end is None:
+        return _parse_file(fname, parse, args)[1]
+    with open(fname, 'rb') as f:
+        f.seek(sta)
+        lines = f.read(end - sta).decode().split('\n')
+    return [parse(line, *args) for line in lines if line]
+
+
+def _parse_file(fname, parse, args):
+    with _open_text(fname) as f:
+        return fname, [parse(line, *args) for line in _read_lines(f)
+                       if line]
+
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
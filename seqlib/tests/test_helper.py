@@ -3,7 +3,7 @@ Testing helper.py
 '''
 
 import pytest
-from seqlib.helper import check_md5
+from seqlib.helper import md5sum, check_md5
 
 
 def test_check_md5():
@@ -12,3 +12,12 @@ def test_check_md5():
     '''
     test_f = pytest.helpers.data_path('test.bam')
     assert check_md5(test_f, '2d055eb6c7ad9779c3e875b121376e90')
+
+
+def test_md5sum():
+    '''
+    Testing md5sum()
+    '''
+    test_f = pytest.helpers.data_path('test.bam')
+    assert md5sum(test_f, chunk_size=100) == \
+        '2d055eb6c7ad9779c3e875b121376e90'
@@ -1,5 +1,9 @@
 import unittest
-from seqlib.interval import Interval
+from unittest import mock
+from seqlib.interval import (Interval, IntervalArray, IntervalIndex,
+                             GenomicIntervalSet, merge_sorted,
+                             intersect_sorted, subtract_sorted,
+                             intersect_many, coverage)
 
 
 class TestInterval(unittest.TestCase):
@@ -24,6 +28,15 @@ class TestInterval(unittest.TestCase):
                                           [17, 25, 'b', 'd'], [30, 35, 'e']],
                              'Failed in initiation')
 
+    def testVectorizedInit(self):
+        with mock.patch('seqlib.interval.VECTORIZED_MERGE_SIZE', 0):
+            a = Interval(self.a)
+            d = Interval(self.d)
+        self.assertListEqual(a.interval, Interval(self.a).interval,
+                             'Failed in vectorized initiation')
+        self.assertListEqual(d.interval, Interval(self.d).interval,
+                             'Failed in vectorized initiation')
+
     def testLen(self):
         a = Interval(self.a)
         self.assertEqual(len(a), 3, 'Failed in length')
@@ -137,6 +150,59 @@ class TestInterval(unittest.TestCase):
                                                [30, 35, 'e']],
                              'Failed in instance a -= b')
 
+    def testOperandUnchanged(self):
+        a = Interval(self.a)
+        b = Interval(self.b)
+        a_items, b_items = [i[:] for i in a.interval], [i[:] for i in b]
+        for c in (a + b, a - b, b - a, self.c - a, a - []):
+            c.interval[0].append('z')
+        self.assertListEqual(a.interval, a_items, 'Failed in keeping a')
+        self.assertListEqual(b.interval, b_items, 'Failed in keeping b')
+
+    def testIntersectMany(self):
+        queries = [self.a, self.c, self.d, []]
+        results = [(Interval(q) * Interval(self.b)).interval for q in queries]
+        self.assertListEqual(intersect_many(self.b, queries), results,
+                             'Failed in intersect_many')
+        self.assertListEqual(intersect_many(self.b, queries, n_jobs=2),
+                             results, 'Failed in parallel intersect_many')
+        self.assertListEqual(intersect_many(self.b, queries, n_jobs=None),
+                             results, 'Failed in intersect_many with None')
+        self.assertListEqual(intersect_many(self.b, queries,
+                                            count=True).tolist(),
+                             [len(r) for r in results],
+                             'Failed in counting intersect_many')
+
+    def testCoverage(self):
+        result = coverage(self.d)
+        self.assertListEqual(result, [[2, 3, 3], [3, 4, 2], [4, 5, 3],
+                                      [5, 6, 4], [6, 10, 3], [10, 11, 2],
+                                      [11, 13, 1], [13, 14, 2], [14, 15, 1],
+                                      [15, 17, 2], [17, 18, 1], [18, 21, 2],
+                                      [21, 24, 1]], 'Failed in coverage')
+        with mock.patch('seqlib.interval.VECTORIZED_MERGE_SIZE', 0):
+            self.assertListEqual(coverage(self.d), result,
+                                 'Failed in vectorized coverage')
+        self.assertListEqual(coverage(self.c, zero=True, sta=0, end=30),
+                             [[0, 3, 0], [3, 7, 1], [7, 10, 0], [10, 12, 1],
+                              [12, 16, 0], [16, 20, 1], [20, 23, 0],
+                              [23, 25, 1], [25, 30, 0]],
+                             'Failed in coverage with zero')
+        self.assertListEqual(coverage([], zero=True, sta=0, end=30),
+                             [[0, 30, 0]], 'Failed in empty coverage')
+        self.assertListEqual(coverage(self.c, zero=True, sta=5, end=18),
+                             [[5, 7, 1], [7, 10, 0], [10, 12, 1],
+                              [12, 16, 0], [16, 18, 1]],
+                             'Failed in clipped coverage with zero')
+        self.assertListEqual(coverage(self.c, sta=11, end=24),
+                             [[11, 12, 1], [16, 20, 1], [23, 24, 1]],
+                             'Failed in clipped coverage')
+        with self.assertRaises(AssertionError):
+            coverage([[10, 5], [1, 20]])
+        with mock.patch('seqlib.interval.VECTORIZED_MERGE_SIZE', 0):
+            with self.assertRaises(AssertionError):
+                coverage([[10, 5], [1, 20]])
+
     def testSlice(self):
         self.a = Interval(self.a)
         self.assertEqual(self.a[1], [17, 25, 'b', 'd'], 'Failed in a[1]')
@@ -185,5 +251,193 @@ class TestInterval(unittest.TestCase):
                                  [23, 25, 'IV', 'x']], 'Failed in Overlapwith')
 
 
+class TestIntervalArray(unittest.TestCase):
+
+    def setUp(self):
+        self.a = [[1, 10, 'a'], [17, 22, 'b'], [7, 12, 'c'], [20, 25, 'd'],
+                  [30, 35, 'e']]
+        self.b = [[5, 12, 'I'], [20, 22, 'II'], [23, 28, 'III']]
+
+    def testInit(self):
+        a = IntervalArray(self.a)
+        self.assertListEqual(a.starts.tolist(), [1, 17, 30],
+                             'Failed in starts')
+        self.assertListEqual(a.ends.tolist(), [12, 25, 35], 'Failed in ends')
+        self.assertListEqual(a.payload, [['a', 'c'], ['b', 'd'], ['e']],
+                             'Failed in payload')
+        self.assertIsNone(IntervalArray([[3, 5], [1, 2]]).payload,
+                          'Failed in empty payload')
+
+    def testConvert(self):
+        a = IntervalArray(self.a)
+        self.assertListEqual(a.tolist(), Interval(self.a).interval,
+                             'Failed in tolist')
+        self.assertListEqual(IntervalArray(Interval(self.a)).tolist(),
+                             a.tolist(), 'Failed in from Interval')
+        self.assertListEqual(a.to_interval().interval, a.tolist(),
+                             'Failed in to_interval')
+        b = IntervalArray.from_arrays([20, 5, 23], [22, 12, 28],
+                                      [['II'], ['I'], ['III']])
+        self.assertListEqual(b.tolist(), Interval(self.b).interval,
+                             'Failed in from_arrays')
+
+    def testOperator(self):
+        a = IntervalArray(self.a)
+        self.assertListEqual((a + self.b).tolist(),
+                             (Interval(self.a) + self.b).interval,
+                             'Failed in c = a + b')
+        self.assertListEqual((a * self.b).tolist(),
+                             (Interval(self.a) * self.b).interval,
+                             'Failed in c = a * b')
+        self.assertListEqual((a - self.b).tolist(),
+                             (Interval(self.a) - self.b).interval,
+                             'Failed in c = a - b')
+        self.assertListEqual((self.b - a).tolist(), [[25, 28, 'III']],
+                             'Failed in c = b - a')
+        self.assertTrue([27, 34] in a, 'Failed in [27, 34] in a')
+        self.assertEqual(a[1], [17, 25, 'b', 'd'], 'Failed in a[1]')
+
+    def testExtract(self):
+        for method in ('extractwith', 'extractwithout'):
+            a = IntervalArray(self.a)
+            b = Interval(self.a)
+            getattr(a, method)(self.b)
+            getattr(b, method)(self.b)
+            self.assertListEqual(a.tolist(), b.interval,
+                                 'Failed in %s' % method)
+        a = IntervalArray(self.a)
+        a.complement(0, 40)
+        self.assertListEqual(a.tolist(), [[0, 1], [12, 17], [25, 30],
+                                          [35, 40]], 'Failed in complement')
+
+
+class TestIntervalIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.d = [[2, 4, 'a'], [2, 7, 'b'], [2, 3, 'c'], [4, 11, 'd'],
+                  [4, 6, 'e'], [5, 9, 'f'], [7, 10, 'g'], [15, 17, 'h'],
+                  [18, 21, 'i'], [9, 24, 'x'], [13, 14, 'y']]
+        self.idx = IntervalIndex(self.d)
+
+    def testLen(self):
+        self.assertEqual(len(self.idx), 11, 'Failed in length')
+
+    def testFind(self):
+        self.assertListEqual(self.idx.find(3, 5), [[2, 7, 'b'], [2, 4, 'a'],
+                                                   [4, 11, 'd'], [4, 6, 'e']],
+                             'Failed in find')
+        self.assertListEqual(self.idx.find(13, 15), [[9, 24, 'x'],
+                                                     [13, 14, 'y']],
+                             'Failed in find')
+        self.assertListEqual(self.idx.find(24, 30), [], 'Failed in find')
+        self.assertListEqual(self.idx.find_point(16), [[9, 24, 'x'],
+                                                       [15, 17, 'h']],
+                             'Failed in find_point')
+
+    def testNearest(self):
+        idx = IntervalIndex([[1, 10, 'a'], [3, 5, 'b'], [15, 20, 'c']])
+        index, dis = idx.upstream([12, 12], [13, 13], ['+', '-'])
+        self.assertListEqual([idx.interval[i][2] for i in index], ['a', 'c'],
+                             'Failed in upstream')
+        self.assertListEqual(dis.tolist(), [2, 2], 'Failed in upstream')
+        index, dis = idx.downstream([0, 12], strand='+')
+        self.assertListEqual(index.tolist(), [0, 2], 'Failed in downstream')
+        self.assertListEqual(dis.tolist(), [0, 2], 'Failed in downstream')
+        index, dis = idx.downstream([0], strand='-')
+        self.assertListEqual(index.tolist(), [-1], 'Failed in downstream')
+        index, dis = idx.nearest([4, 11, 25])
+        self.assertListEqual(index.tolist(), [0, 0, 2], 'Failed in nearest')
+        self.assertListEqual(dis.tolist(), [0, -1, -5], 'Failed in nearest')
+        self.assertListEqual(idx.window([12], [13], 1), [[]],
+                             'Failed in window')
+        self.assertListEqual(idx.window([12], [13], 2), [[[1, 10, 'a'],
+                                                          [15, 20, 'c']]],
+                             'Failed in window')
+
+    def testBatch(self):
+        queries = [[0, 2], [3, 5], [13, 15], [16, 19]]
+        self.assertListEqual(self.idx.find_batch(queries),
+                             [self.idx.find(*q) for q in queries],
+                             'Failed in find_batch')
+        self.assertListEqual(self.idx.count_batch(queries).tolist(),
+                             [0, 4, 2, 3], 'Failed in count_batch')
+
+
+class TestGenomicIntervalSet(unittest.TestCase):
+
+    def setUp(self):
+        self.a = GenomicIntervalSet([['chr2', 1, 10, 'a'], ['chr10', 17, 22],
+                                     ['chr2', 7, 12, 'c'], ['chr1', 30, 35]])
+        self.b = GenomicIntervalSet([['chr2', 5, 8, 'I'], ['chr1', 31, 40],
+                                     ['chrX', 1, 5]])
+
+    def testItems(self):
+        self.assertListEqual(list(self.a),
+                             [('chr1', None, [30, 35]),
+                              ('chr10', None, [17, 22]),
+                              ('chr2', None, [1, 12, 'a', 'c'])],
+                             'Failed in items')
+        self.assertListEqual(list(self.a.items(merge=False))[2:],
+                             [('chr2', None, [1, 10, 'a']),
+                              ('chr2', None, [7, 12, 'c'])],
+                             'Failed in unmerged items')
+        self.assertEqual(len(self.a), 3, 'Failed in length')
+        self.assertListEqual(self.a['chr2'].interval, [[1, 12, 'a', 'c']],
+                             'Failed in a[chrom]')
+
+    def testOperator(self):
+        self.assertListEqual(list(self.a + self.b),
+                             [('chr1', None, [30, 40]),
+                              ('chr10', None, [17, 22]),
+                              ('chr2', None, [1, 12, 'a', 'I', 'c']),
+                              ('chrX', None, [1, 5])], 'Failed in c = a + b')
+        self.assertListEqual(list(self.a * self.b),
+                             [('chr1', None, [31, 35]),
+                              ('chr2', None, [5, 8, 'a', 'c', 'I'])],
+                             'Failed in c = a * b')
+        self.assertListEqual(list(self.a.difference(self.b, n_jobs=2)),
+                             [('chr1', None, [30, 31]),
+                              ('chr10', None, [17, 22]),
+                              ('chr2', None, [1, 5, 'a', 'c']),
+                              ('chr2', None, [8, 12, 'a', 'c'])],
+                             'Failed in c = a - b')
+
+    def testStranded(self):
+        a = GenomicIntervalSet(stranded=True, chrom_order=['chr2', 'chr1'])
+        a.add('chr1', [[1, 5], [3, 8]], '+')
+        a.add('chr1', [2, 4], '-')
+        a.add('chr2', [1, 2], '-')
+        self.assertListEqual(a.keys(), [('chr2', '-'), ('chr1', '+'),
+                                        ('chr1', '-')], 'Failed in keys')
+        self.assertListEqual(a['chr1', '+'].interval, [[1, 8]],
+                             'Failed in a[chrom, strand]')
+
+
+class TestSortedStream(unittest.TestCase):
+
+    def setUp(self):
+        self.a = sorted([[1, 10, 'a'], [17, 22, 'b'], [7, 12, 'c'],
+                         [20, 25, 'd'], [30, 35, 'e']])
+        self.b = [[5, 12, 'I'], [20, 22, 'II'], [23, 28, 'III']]
+
+    def testStream(self):
+        self.assertListEqual(list(merge_sorted(iter(self.a))),
+                             Interval(self.a).interval, 'Failed in merge')
+        self.assertListEqual(list(intersect_sorted(iter(self.a),
+                                                   iter(self.b))),
+                             (Interval(self.a) * self.b).interval,
+                             'Failed in intersect')
+        self.assertListEqual(list(subtract_sorted(iter(self.a),
+                                                  iter(self.b))),
+                             (Interval(self.a) - self.b).interval,
+                             'Failed in subtract')
+        self.assertListEqual(list(subtract_sorted(self.b, [])), self.b,
+                             'Failed in subtract')
+
+    def testUnsorted(self):
+        with self.assertRaises(AssertionError):
+            list(merge_sorted([[5, 12], [1, 3]]))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -4,8 +4,16 @@ Testing parse.py
 
 import os
 import os.path
+import struct
+import zlib
 import pytest
+import numpy as np
 from seqlib.ngs import fetch_juncfile, bam_to_bedgraph
+from seqlib.ngs import write_bigwig, write_bigbed, bed_to_bigbed
+from seqlib.ngs import BIGWIG_MAGIC, BIGBED_MAGIC
+from seqlib.ngs import _bam_regions, _count_junc, _read_juncs
+from seqlib.ngs import _read_blocks, _depth_runs, _round_depth, _add_events
+from seqlib.ngs import _chrom_coverage
 
 
 def test_fetch_juncfile():
@@ -31,6 +39,32 @@ def test_fetch_juncfile():
     pytest.helpers.check_file(junc,
                               pytest.helpers.data_path('junc_paired.bed'))
     os.remove(junc)
+    junc = fetch_juncfile(pytest.helpers.data_path('junc.bam'),
+                          stranded=True, n_jobs=2)
+    pytest.helpers.check_file(junc,
+                              pytest.helpers.data_path('junc_stranded.bed'))
+    os.remove(junc)
+    junc = fetch_juncfile(pytest.helpers.data_path('junc.bam'), n_jobs=2,
+                          bin_size=10000000)
+    pytest.helpers.check_file(junc,
+                              pytest.helpers.data_path('junc_unstranded.bed'))
+    os.remove(junc)
+
+
+def test_count_junc():
+    '''
+    Testing region-parallel junction counting
+    '''
+    bam = pytest.helpers.data_path('junc.bam')
+    regions = _bam_regions(bam, bin_size=10000000)
+    assert regions[0] == ('chr1', 0, 10000000)
+    assert all(end - start <= 10000000 for _, start, end in regions)
+    serial = _count_junc(bam, None, False, True)
+    merged = {}
+    for region in regions:
+        for junc, count in _count_junc(bam, region, False, True).items():
+            merged[junc] = merged.get(junc, 0) + count
+    assert list(merged.items()) == list(serial.items())
 
 
 def test_bam_to_bedgraph():
@@ -50,3 +84,198 @@ def test_bam_to_bedgraph():
     os.remove(pbg)
     pytest.helpers.check_file(mbg, pytest.helpers.data_path('minusS.bg'))
     os.remove(mbg)
+    bg = bam_to_bedgraph(pytest.helpers.data_path('test.bam'), n_jobs=2)
+    pytest.helpers.check_file(bg, pytest.helpers.data_path('unstranded.bg'))
+    os.remove(bg)
+
+
+def test_coverage():
+    '''
+    Testing native coverage helpers
+    '''
+    starts, ends = [], []
+    _read_blocks(100, [(4, 5), (0, 10), (2, 5), (0, 10), (3, 100), (1, 2),
+                       (0, 10)], starts, ends)  # 5S10M5D10M100N2I10M
+    assert list(zip(starts, ends)) == [(100, 125), (225, 235)]
+    events = _add_events(None, [1, 5], [10, 8])
+    events = _add_events(events, [5, 10, 20], [10, 12, 25])
+    starts, ends, depth = _depth_runs(*events)
+    assert list(zip(starts, ends, depth)) == [(1, 5, 1), (5, 8, 3),
+                                              (8, 10, 2), (10, 12, 1),
+                                              (20, 25, 1)]
+    assert _round_depth(np.array([1, 2, 3]), 0.5).tolist() == [1, 1, 2]
+    assert _round_depth(np.array([1, 2, 3]), -0.5).tolist() == [0, 0, -1]
+
+
+def test_read_juncs():
+    '''
+    Testing junction extraction from cigartuples
+    '''
+    # 79M35788N5M56N16M
+    assert _read_juncs(100, [(0, 79), (3, 35788), (0, 5), (3, 56),
+                             (0, 16)]) == [(179, 35967), (35972, 36028)]
+    # 84M35808N3D16M, 5S10M2I10M100N10M
+    assert _read_juncs(0, [(0, 84), (3, 35808), (2, 3), (0, 16)]) == \
+        [(84, 35895)]
+    assert _read_juncs(0, [(4, 5), (0, 10), (1, 2), (0, 10), (3, 100),
+                           (0, 10)]) == [(20, 120)]
+    assert _read_juncs(0, [(0, 10), (2, 5), (0, 10)]) == []
+    bam = pytest.helpers.data_path('junc.bam')
+    serial = _count_junc(bam, None, False, False)
+    assert list(_count_junc(bam, None, False, False, batch_size=7).items()) \
+        == list(serial.items())
+
+
+def test_stranded_coverage(monkeypatch):
+    '''
+    Testing both strands are computed in the same pass
+    '''
+    bam = pytest.helpers.data_path('test.bam')
+    for contig, _, _ in _bam_regions(bam):
+        both = _chrom_coverage(bam, contig, [(True, 2), (False, -2)])
+        for track, result in zip([(True, 2), (False, -2)], both):
+            single = _chrom_coverage(bam, contig, [track])[0]
+            assert all((a == b).all() for a, b in zip(result, single))
+        # blocks flushed into events in small chunks
+        monkeypatch.setattr('seqlib.ngs.COVERAGE_CHUNK', 3)
+        chunked = _chrom_coverage(bam, contig, [(True, 2), (False, -2)])
+        monkeypatch.undo()
+        for result, single in zip(both, chunked):
+            assert all((a == b).all() for a, b in zip(result, single))
+
+
+def _read_bbi(fn):
+    '''
+    Read a BigWig/BigBed file back through its chromosome B+ tree and R-tree
+    indexes: return chrom sizes, data items and zoom records
+    '''
+    with open(fn, 'rb') as f:
+        data = f.read()
+    header = struct.unpack_from('<IHHQQQHHQQIQ', data)
+    magic, zoom_num, chrom_tree, index = header[0], header[2], header[3], \
+        header[5]
+    assert struct.unpack_from('<I', data, len(data) - 4)[0] == magic
+    _, _, key_size, _, chrom_num, _ = struct.unpack_from('<IIIIQQ', data,
+                                                         chrom_tree)
+    chroms = {}
+
+    def walk_bpt(offset):
+        is_leaf, _, count = struct.unpack_from('<BBH', data, offset)
+        for k in range(count):
+            item = offset + 4 + k * (key_size + 8)
+            key = data[item:item + key_size].rstrip(b'\0').decode()
+            if is_leaf:
+                chroms[key] = struct.unpack_from('<II', data, item + key_size)
+            else:
+                walk_bpt(struct.unpack_from('<Q', data, item + key_size)[0])
+
+    def walk_cirtree(offset, bounds):
+        is_leaf, _, count = struct.unpack_from('<BBH', data, offset)
+        blocks = []
+        for k in range(count):
+            if is_leaf:
+                item = struct.unpack_from('<IIIIQQ', data,
+                                          offset + 4 + k * 32)
+            else:
+                item = struct.unpack_from('<IIIIQ', data,
+                                          offset + 4 + k * 24)
+            # every node lies within the bounds of its parent
+            assert bounds[:2] <= item[:2] and item[2:4] <= bounds[2:]
+            if is_leaf:
+                blocks.append(item)
+            else:
+                blocks.extend(walk_cirtree(item[4], item[:4]))
+        return blocks
+
+    def blocks(offset):
+        values = struct.unpack_from('<IIQIIIIQII', data, offset)
+        items = []
+        for block in walk_cirtree(offset + 48, values[3:7]):
+            raw = zlib.decompress(data[block[4]:block[4] + block[5]])
+            items.append((block[:4], raw))
+        return items
+
+    walk_bpt(chrom_tree + 32)
+    assert len(chroms) == chrom_num
+    names = {cid: name for name, (cid, _) in chroms.items()}
+    items = []
+    for bounds, raw in blocks(index):
+        if magic == BIGWIG_MAGIC:
+            cid, start, end, _, _, kind, _, count = \
+                struct.unpack_from('<IIIIIBBH', raw)
+            assert kind == 1  # bedGraph items
+            block_items = [(names[cid], x, y, v) for x, y, v in
+                           struct.iter_unpack('<IIf', raw[24:])]
+        else:
+            block_items = []
+            while raw:
+                cid, x, y = struct.unpack_from('<III', raw)
+                rest, _, raw = raw[12:].partition(b'\0')
+                block_items.append((names[cid], x, y, rest.decode()))
+        for item in block_items:
+            assert bounds[1] <= item[1] and item[2] <= bounds[3]
+        items.extend(block_items)
+    zooms = []
+    for k in range(zoom_num):
+        reduction, _, _, zoom_index = struct.unpack_from('<IIQQ', data,
+                                                         64 + k * 24)
+        zooms.append((reduction, [record for _, raw in blocks(zoom_index)
+                                  for record in
+                                  struct.iter_unpack('<IIIIffff', raw)]))
+    sizes = {name: size for name, (_, size) in chroms.items()}
+    return sizes, items, zooms
+
+
+def test_bigwig(tmpdir):
+    '''
+    Testing BigWig/BigBed writers
+    '''
+    bam = pytest.helpers.data_path('test.bam')
+    bw = bam_to_bedgraph(bam, dir=str(tmpdir), bigwig=True)
+    bg = bam_to_bedgraph(bam, dir=str(tmpdir))
+    with open(bg) as f:
+        runs = [(chrom, int(x), int(y), float(v)) for chrom, x, y, v in
+                (line.split() for line in f)]
+    sizes, items, zooms = _read_bbi(bw)
+    assert sorted(items) == sorted(runs)
+    for _, records in zooms:  # every zoom level keeps the coverage sum
+        assert sum(r[3] for r in records) == sum(y - x for _, x, y, _ in runs)
+        assert abs(sum(r[6] for r in records) -
+                   sum((y - x) * v for _, x, y, v in runs)) < 1e-3 * \
+            sum((y - x) * v for _, x, y, v in runs)
+    # multi-level chromosome B+ tree and R-tree
+    chrom_sizes = [('chr%d' % i, 100000) for i in range(300)]
+    coverage = [(chrom, np.arange(0, 2000, 100), np.arange(50, 2050, 100),
+                 np.arange(20) % 7 + 1) for chrom, _ in chrom_sizes]
+    bw = str(tmpdir.join('multi.bw'))
+    write_bigwig(bw, chrom_sizes, coverage, items_per_slot=4)
+    sizes, items, zooms = _read_bbi(bw)
+    assert sizes == {chrom: 100000 for chrom, _, _, _ in coverage}
+    assert sorted(items) == sorted((chrom, x, y, v) for chrom, starts, ends,
+                                   values in coverage for x, y, v in
+                                   zip(starts, ends, values))
+    assert zooms and all(sum(r[3] for r in records) == 300 * 50 * 20
+                         for _, records in zooms)
+    bb = str(tmpdir.join('test.bb'))
+    records = [('chr1', i, i + 10, 'r%d\t0\t+' % i) for i in range(3001)]
+    records.append(('chr2', 0, 50, 'b\t0\t-'))
+    write_bigbed(bb, [('chr1', 5000), ('chr2', 500)], records,
+                 items_per_slot=16)
+    with open(bb, 'rb') as f:
+        data = f.read()
+    header = struct.unpack_from('<IHHQQQHHQQIQ', data)
+    assert header[0] == BIGBED_MAGIC and header[6] == 12
+    assert struct.unpack_from('<Q', data, header[4])[0] == len(records)
+    sizes, items, _ = _read_bbi(bb)
+    assert sizes == {'chr1': 5000, 'chr2': 500}
+    assert sorted(items) == sorted(records)
+    bed = tmpdir.join('junc.bed')
+    bed.write('chr2\t0\t50\tjunc/1\t0\t+\t0\t50\t0,0,0\t2\t5,10\t0,40\n')
+    bb = bed_to_bigbed(str(bed), [('chr2', 500)])
+    assert bb == str(tmpdir.join('junc.bb'))
+    assert _read_bbi(bb)[1] == [('chr2', 0, 50, 'junc/1\t0\t+\t0\t50\t'
+                                 '0,0,0\t2\t5,10\t0,40')]
+    with pytest.raises(SystemExit):
+        write_bigbed(bb, [('chr2', 500)], [('chr2', -5, 50, 'b\t0\t-')])
+    with pytest.raises(SystemExit):
+        write_bigbed(bb, [('chr2', 500)], [('chr2', 450, 510, 'b\t0\t-')])
@@ -2,8 +2,18 @@
 Testing parse.py
 '''
 
+import io
+import gzip
 import os.path
-from seqlib.parse import Junc
+import pytest
+import msgpack
+import numpy as np
+from seqlib.parse import Info, Annotation, Junc, load_annotation, parse_gtf
+from seqlib.parse import load_star_junc, junc_matrix, load_annotation_index
+from seqlib.parse import read_annotation, read_junc, read_junc_files
+from seqlib.parse import TranscriptMapper, FEATURES, _read_lines
+from seqlib.parse import _PipeReader
+from seqlib.interval import Interval
 
 
 def test_junc(tmpdir):
@@ -34,3 +44,341 @@ def test_star_junc(tmpdir):
     _, _, _, _, read = list(Junc(junc_bed_f, aligner='STAR',
                                  read_type='unique'))[0]
     assert read == 149
+
+
+def test_info():
+    ref = Info(['DDX11L1', 'uc010nxq.1', 'chr1', '+', '11873', '14409',
+                '12189', '13639', '3', '11873,12594,13402,',
+                '12227,12721,14409,'])
+    bed = Info(['chr1', '11873', '14409', 'uc010nxq.1', '0', '+', '12189',
+                '13639', '0,0,0', '3', '354,127,1007', '0,721,1529'],
+               ftype='bed')
+    assert not hasattr(ref, '__dict__')
+    for attr in ('chrom', 'strand', 'tx_start', 'tx_end', 'cds_start',
+                 'cds_end', 'exon_num', 'exon_starts', 'exon_ends',
+                 'exon_lengths', 'intron_starts', 'intron_ends',
+                 'intron_lengths', 'utr5_regions', 'cds_regions',
+                 'utr3_regions'):
+        assert getattr(ref, attr) == getattr(bed, attr)
+    assert ref.exon_starts is not ref.exon_starts
+
+
+def test_load_annotation(tmpdir):
+    ref = tmpdir.join('anno.ref')
+    ref.write('\n'.join(['\t'.join(['DDX11L1', 'uc010nxq.1', 'chr1', '+',
+                                    '11873', '14409', '12189', '13639', '3',
+                                    '11873,12594,13402,',
+                                    '12227,12721,14409,']),
+                         '\t'.join(['WASH7P', 'uc009vis.3', 'chr1', '-',
+                                    '14361', '16765', '14361', '14361', '4',
+                                    '14361,14969,15795,16606,',
+                                    '14829,15038,15947,16765,']),
+                         '\t'.join(['TEST', 'test.1', 'chr2', '-', '100',
+                                    '900', '200', '800', '2', '100,500,',
+                                    '300,900,'])]) + '\n')
+    table = load_annotation(str(ref))
+    assert len(table) == 3
+    assert table.gene.tolist() == ['DDX11L1', 'WASH7P', 'TEST']
+    assert table.exon_offsets.tolist() == [0, 3, 7, 9]
+    infos = list(Annotation(str(ref)))
+    for region in ('utr5_regions', 'utr3_regions', 'cds_regions'):
+        tid, starts, ends = getattr(table, region)()
+        for i, info in enumerate(infos):
+            assert [[s, e] for s, e in zip(starts[tid == i],
+                                           ends[tid == i])] == \
+                getattr(info, region)
+    tid, starts, ends = table.intron_regions()
+    assert tid.tolist() == [0, 0, 1, 1, 1, 2]
+    assert starts.tolist() == sum((i.intron_starts for i in infos), [])
+    # overlapping exons are merged and touching ones kept as Interval.split
+    ref.write('\t'.join(['TOUCH', 'touch.1', 'chr3', '+', '100', '900',
+                         '200', '800', '4', '100,300,450,850,',
+                         '300,500,600,900,']) + '\n')
+    table = load_annotation(str(ref))
+    exons = [[100, 300], [300, 500], [450, 600], [850, 900]]
+    for region, flag in (('utr5_regions', 'left'), ('utr3_regions', 'right'),
+                         ('cds_regions', 'middle')):
+        _, starts, ends = getattr(table, region)()
+        assert [[s, e] for s, e in zip(starts, ends)] == \
+            Interval.split(exons, 200, 800, flag)
+
+
+def test_annotation_cache(tmpdir):
+    ref = tmpdir.join('anno.ref')
+    line = '\t'.join(['DDX11L1', 'uc010nxq.1', 'chr1', '+', '11873', '14409',
+                      '12189', '13639', '3', '11873,12594,13402,',
+                      '12227,12721,14409,']) + '\n'
+    ref.write(line)
+    table = load_annotation(str(ref), cache=True)
+    cache_dir = str(ref) + '.ref.cache'
+    assert os.path.isdir(cache_dir)
+    umask = os.umask(0)
+    os.umask(umask)
+    assert os.stat(cache_dir).st_mode & 0o777 == 0o777 & ~umask
+    meta_f = os.path.join(cache_dir, 'meta.msg')
+    with open(meta_f, 'rb') as f:
+        assert 'md5' not in msgpack.unpackb(f.read(), raw=False)
+    cached = load_annotation(str(ref), cache=True, checksum=True)
+    with open(meta_f, 'rb') as f:  # MD5 is recorded on the first check
+        assert 'md5' in msgpack.unpackb(f.read(), raw=False)
+    assert isinstance(cached.exon_starts, np.memmap)
+    assert cached.exon_starts.tolist() == table.exon_starts.tolist()
+    assert cached.gene.tolist() == ['DDX11L1']
+    # a partial or corrupt cache is rebuilt
+    os.remove(os.path.join(cache_dir, 'gene.npy'))
+    assert load_annotation(str(ref), cache=True).gene.tolist() == ['DDX11L1']
+    assert os.path.isfile(os.path.join(cache_dir, 'gene.npy'))
+    with open(os.path.join(cache_dir, 'exon_starts.npy'), 'wb') as f:
+        f.write(b'corrupt')
+    cached = load_annotation(str(ref), cache=True)
+    assert cached.exon_starts.tolist() == table.exon_starts.tolist()
+    ref.write(line.replace('DDX11L1', 'DDX11L10'))  # stale cache
+    assert load_annotation(str(ref), cache=True).gene.tolist() == ['DDX11L10']
+
+
+GTF_ATTR = 'gene_id "G1"; transcript_id "uc010nxq.1"; gene_name "DDX11L1";'
+GTF = '\n'.join(['#!genome-build GRCh37',
+                 'chr1\tHAVANA\tgene\t11874\t14409\t.\t+\t.\t'
+                 'gene_id "G1"; gene_name "DDX11L1";'] +
+                ['\t'.join(['chr1', 'HAVANA', feature, sta, end, '.', '+',
+                            '.', GTF_ATTR])
+                 for feature, sta, end in (('transcript', '11874', '14409'),
+                                           ('exon', '11874', '12227'),
+                                           ('exon', '12595', '12721'),
+                                           ('CDS', '12190', '12227'),
+                                           ('CDS', '12595', '12721'),
+                                           ('exon', '13403', '14409'),
+                                           ('CDS', '13403', '13636'),
+                                           ('stop_codon', '13637', '13639'))] +
+                ['\t'.join(['chr2', 'HAVANA', 'exon', sta, end, '.', '-', '.',
+                            'gene_id "G2"; transcript_id "test.1";'])
+                 for sta, end in (('501', '900'), ('101', '300'))]) + '\n'
+
+GFF = '''##gff-version 3
+chr1\tHAVANA\tgene\t11874\t14409\t.\t+\t.\tID=G1;Name=DDX11L1
+chr1\tHAVANA\tmRNA\t11874\t14409\t.\t+\t.\tID=uc010nxq.1;Parent=G1
+chr1\tHAVANA\texon\t11874\t12227\t.\t+\t.\tParent=uc010nxq.1
+chr1\tHAVANA\texon\t12595\t12721\t.\t+\t.\tParent=uc010nxq.1
+chr1\tHAVANA\texon\t13403\t14409\t.\t+\t.\tParent=uc010nxq.1
+chr1\tHAVANA\tCDS\t12190\t12227\t.\t+\t0\tID=cds1;Parent=uc010nxq.1
+chr1\tHAVANA\tCDS\t12595\t12721\t.\t+\t0\tID=cds1;Parent=uc010nxq.1
+chr1\tHAVANA\tCDS\t13403\t13639\t.\t+\t0\tID=cds1;Parent=uc010nxq.1
+chr2\tHAVANA\tgene\t101\t900\t.\t-\t.\tID=G2
+chr2\tHAVANA\tncRNA\t101\t900\t.\t-\t.\tID=test.1;Parent=G2
+chr2\tHAVANA\texon\t101\t300\t.\t-\t.\tParent=test.1
+chr2\tHAVANA\texon\t501\t900\t.\t-\t.\tParent=test.1
+'''
+
+
+def test_gtf(tmpdir):
+    expected = [Info(['DDX11L1', 'uc010nxq.1', 'chr1', '+', '11873', '14409',
+                      '12189', '13639', '3', '11873,12594,13402,',
+                      '12227,12721,14409,']),
+                Info(['G2', 'test.1', 'chr2', '-', '100', '900', '900', '900',
+                      '2', '100,500,', '300,900,'])]
+    for ftype, content in (('gtf', GTF), ('gff', GFF)):
+        anno = tmpdir.join('anno.' + ftype)
+        anno.write(content)
+        for infos in (list(Annotation(str(anno), ftype=ftype)),
+                      parse_gtf(str(anno), ftype=ftype, n_jobs=2)):
+            assert len(infos) == 2
+            for info, ref in zip(infos, expected):
+                for attr in ('gene', 'isoform', 'chrom', 'strand', 'tx_start',
+                             'tx_end', 'cds_start', 'cds_end', 'exon_starts',
+                             'exon_ends', 'utr5_regions', 'cds_regions'):
+                    assert getattr(info, attr) == getattr(ref, attr)
+    # features of a gene split by another gene
+    lines = GTF.splitlines()
+    anno = tmpdir.join('interleaved.gtf')
+    anno.write('\n'.join(lines[:4] + lines[-1:] + lines[4:-1]) + '\n')
+    with pytest.raises(SystemExit):
+        list(Annotation(str(anno), ftype='gtf'))
+    lines = GFF.splitlines()
+    anno = tmpdir.join('interleaved.gff')
+    anno.write('\n'.join(lines[:4] + lines[9:] + lines[4:9]) + '\n')
+    with pytest.raises(SystemExit):
+        list(Annotation(str(anno), ftype='gff'))
+
+
+def test_gzip(tmpdir):
+    line = '\t'.join(['chr2L', '13626', '13682', '2', '2', '1', '149', '3',
+                      '39'])
+    plain = tmpdir.join('SJ.out.tab')
+    plain.write('\n'.join([line] * 5))  # no trailing newline
+    compressed = os.path.join(str(tmpdir), 'SJ.out.tab.gz')
+    with gzip.open(compressed, 'wt') as f:
+        f.write(line + '\n')
+    with gzip.open(compressed, 'at') as f:  # bgzip-like multiple members
+        f.write(line + '\n')
+    juncs = list(Junc(str(plain), aligner='STAR'))
+    assert len(juncs) == 5
+    assert list(Junc(compressed, aligner='STAR')) == juncs[:2]
+    lines = list(_read_lines(io.StringIO('a\nbb\n\nccc'), block_size=3))
+    assert lines == ['a', 'bb', '', 'ccc']
+    anno = os.path.join(str(tmpdir), 'anno.gtf.gz')
+    with gzip.open(anno, 'wt') as f:
+        f.write(GTF)
+    assert [info.isoform for info in parse_gtf(anno, n_jobs=2)] == \
+        ['uc010nxq.1', 'test.1']
+    with open(anno, 'rb') as f:
+        data = f.read()
+    truncated = os.path.join(str(tmpdir), 'truncated.gz')
+    with open(truncated, 'wb') as f:
+        f.write(data[:-10])
+    with pytest.raises(SystemExit):
+        with _PipeReader(['gzip', '-dc', truncated]) as f:
+            list(_read_lines(f))
+    reader = _PipeReader(['gzip', '-dc', truncated])
+    list(reader)  # line iteration bypasses read(), so close() must check
+    with pytest.raises(SystemExit):
+        reader.close()
+
+
+def test_star_junc_table(tmpdir):
+    sample1 = tmpdir.join('s1.SJ.out.tab')
+    sample1.write('chr2L\t13626\t13682\t2\t2\t1\t149\t3\t39\n'
+                  'chr1\t100\t200\t1\t1\t0\t5\t0\t20\n')
+    sample2 = tmpdir.join('s2.SJ.out.tab')
+    sample2.write('chr2L\t13626\t13682\t2\t2\t1\t10\t1\t39\n')
+    table = load_star_junc(str(sample1))
+    assert len(table) == 2
+    juncs = list(Junc(str(sample1), aligner='STAR'))
+    assert list(zip(table.chrom, table.start, table.end, table.strand,
+                    table.read)) == juncs
+    assert table.motif.tolist() == ['CT/AC', 'GT/AG']
+    assert table.is_annotated.tolist() == [True, False]
+    assert table.uniq_read.dtype == np.int32
+    chrom, start, end, strand, matrix = junc_matrix([str(sample1),
+                                                     str(sample2)])
+    assert chrom.tolist() == ['chr1', 'chr2L']
+    assert start.tolist() == [99, 13625]
+    assert strand.tolist() == ['+', '-']
+    assert matrix.tolist() == [[5, 0], [152, 11]]
+    _, _, _, _, matrix = junc_matrix([str(sample1), str(sample2)],
+                                     read_type='unique', n_jobs=2)
+    assert matrix.tolist() == [[5, 0], [149, 10]]
+    sample3 = tmpdir.join('s3.SJ.out.tab')
+    sample3.write('chrUn_KI270442v1\t1\t2\t0\t0\t0\t1\t0\t1')
+    table = load_star_junc(str(sample3))
+    assert table.chrom.tolist() == ['chrUn_KI270442v1']
+    assert table.overhang.tolist() == [1]
+    sample3.write('')
+    assert len(load_star_junc(str(sample3))) == 0
+
+
+def test_annotation_index(tmpdir):
+    ref = tmpdir.join('anno.ref')
+    ref.write('\n'.join(['\t'.join(['DDX11L1', 'uc010nxq.1', 'chr1', '+',
+                                    '11873', '14409', '12189', '13639', '3',
+                                    '11873,12594,13402,',
+                                    '12227,12721,14409,']),
+                         '',
+                         '\t'.join(['WASH7P', 'uc009vis.3', 'chr1', '-',
+                                    '14361', '16765', '14361', '14361', '4',
+                                    '14361,14969,15795,16606,',
+                                    '14829,15038,15947,16765,']),
+                         '\t'.join(['DDX11L1', 'test.1', 'chr2', '-', '100',
+                                    '900', '200', '800', '2', '100,500,',
+                                    '300,900,'])]) + '\n')
+    anno = Annotation(str(ref))
+    assert [info.isoform for info in anno.fetch_gene('DDX11L1')] == \
+        ['uc010nxq.1', 'test.1']
+    assert anno.fetch_gene('TP53') == []
+    assert anno.fetch_isoform('uc009vis.3').cds_regions == []
+    assert anno.fetch_isoform('uc009vis.4') is None
+    assert [info.gene for info in anno.fetch('chr1', 14000, 14400)] == \
+        ['DDX11L1', 'WASH7P']
+    assert [info.gene for info in anno.fetch('chr1', 14409, 14410)] == \
+        ['WASH7P']
+    assert anno.fetch('chrX', 0, 1000) == []
+    assert next(anno).isoform == 'uc010nxq.1'  # iteration is independent
+    anno.close()
+    assert os.path.isdir(str(ref) + '.ref.index')
+    index = load_annotation_index(str(ref))
+    assert isinstance(index.offset, np.memmap)
+    assert index.isoform_records('test.1') == [2]
+
+
+def test_read_chunks(tmpdir):
+    lines = ['\t'.join(['chr2L', str(100 * i + 1), str(100 * i + 50), '1',
+                        '1', '0', str(i), '0', '20']) for i in range(50)]
+    sj = tmpdir.join('SJ.out.tab')
+    sj.write('\n'.join(lines) + '\n')
+    juncs = list(Junc(str(sj), aligner='STAR'))
+    for chunk_size in (1, 100, 1 << 20):
+        assert list(read_junc(str(sj), aligner='STAR', n_jobs=2,
+                              chunk_size=chunk_size)) == juncs
+    assert sorted(read_junc(str(sj), aligner='STAR', n_jobs=2, ordered=False,
+                            chunk_size=100)) == sorted(juncs)
+    ref = tmpdir.join('anno.ref')
+    ref.write('\n'.join(['\t'.join(['G%d' % i, 'T%d' % i, 'chr1', '+',
+                                    '100', '900', '200', '800', '2',
+                                    '100,500,', '300,900,'])
+                         for i in range(20)]))
+    assert [info.gene for info in read_annotation(str(ref), n_jobs=2,
+                                                  chunk_size=64)] == \
+        ['G%d' % i for i in range(20)]
+    results = list(read_junc_files([str(sj), str(sj)], aligner='STAR',
+                                   read_type='unique', n_jobs=2))
+    assert [fname for fname, _ in results] == [str(sj), str(sj)]
+    assert results[0][1][-1] == ('chr2L', 4900, 4950, '+', 49)
+
+
+def test_features(tmpdir):
+    anno = tmpdir.join('anno.gtf')
+    anno.write(GTF)
+    table = load_annotation(str(anno), ftype='gtf')
+    assert table.isoform.tolist() == ['uc010nxq.1', 'test.1']
+    infos = parse_gtf(str(anno))
+    features = table.features(dis=50, direction='upstream')
+    assert sorted(features) == sorted(FEATURES)
+    tid, starts, ends = features['TSS']
+    assert list(zip(starts, ends)) == [(11823, 11873), (900, 950)]
+    tid, starts, ends = features['TES']
+    assert list(zip(starts, ends)) == [(14359, 14409), (100, 150)]
+    tid, starts, ends = features['gene']
+    assert list(zip(starts, ends)) == [(11823, 14409), (100, 950)]
+    for name, attr in (('5UTR', 'utr5_regions'), ('CDS', 'cds_regions'),
+                       ('3UTR', 'utr3_regions')):
+        tid, starts, ends = table.features([name])[name]
+        assert [[s, e] for s, e in zip(starts, ends)] == \
+            sum((getattr(info, attr) for info in infos), [])
+
+
+def test_transcript_mapper():
+    infos = [Info(['DDX11L1', 'uc010nxq.1', 'chr1', '+', '11873', '14409',
+                   '12189', '13639', '3', '11873,12594,13402,',
+                   '12227,12721,14409,']),
+             Info(['TEST', 'test.1', 'chr2', '-', '100', '400', '150', '350',
+                   '2', '100,300,', '200,400,']),
+             Info(['NC', 'nc.1', 'chr2', '-', '100', '400', '400', '400',
+                   '2', '100,300,', '200,400,'])]
+    mapper = TranscriptMapper(infos)
+    assert mapper.mRNA_length.tolist() == [1488, 200, 200]
+    assert mapper.cds_offset.tolist() == [316, 50, -1]
+    assert mapper.cds_length.tolist() == [402, 100, 0]
+    pos = np.array([11873, 12227, 12594, 12189, 14408, 14409, 11872])
+    tx = mapper.genome_to_transcript(0, pos)
+    assert tx.tolist() == [0, -1, 354, 316, 1487, -1, -1]
+    assert mapper.transcript_to_genome(0, tx).tolist() == \
+        [11873, -1, 12594, 12189, 14408, -1, -1]
+    assert mapper.genome_to_cds(0, pos).tolist() == [-1, -1, 38, 0, -1, -1,
+                                                     -1]
+    assert mapper.genome_to_transcript([1, 1, 1, 2], [399, 300, 250, 100]) \
+        .tolist() == [0, 99, -1, 199]
+    assert mapper.genome_to_cds([1, 1, 1, 2], [349, 150, 399, 349]) \
+        .tolist() == [0, 99, -1, -1]
+    assert mapper.cds_to_genome(1, [0, 49, 50, 99, 100]).tolist() == \
+        [349, 300, 199, 150, -1]
+    assert mapper.cds_to_genome(2, [0]).tolist() == [-1]
+    mapper = TranscriptMapper(infos[2:])  # non-coding only
+    assert mapper.cds_offset.tolist() == [-1]
+    assert mapper.genome_to_cds(0, [150]).tolist() == [-1]
+    mapper = TranscriptMapper([])
+    assert mapper.genome_to_transcript(0, [1, 2]).tolist() == [-1, -1]
+    assert mapper.transcript_to_genome([0, 1], 0).tolist() == [-1, -1]
+    assert mapper.genome_to_cds(0, 5).tolist() == -1
+    assert mapper.cds_to_genome(0, [0]).tolist() == [-1]
+    with pytest.raises(AssertionError):
+        TranscriptMapper([Info(['OV', 'ov.1', 'chr2', '+', '100', '400',
+                                '100', '400', '2', '100,150,', '200,400,'])])
@@ -28,6 +28,8 @@ setup(name='seqlib',
       ext_modules=cythonize(ext_modules),
       install_requires=[
           'future',
+          'numpy',
+          'joblib>=1.4',
           'requests',
           'pysam>=0.8.4',
           'pybedtools>=0.7.8',